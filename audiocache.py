@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# audiocache.py
+# This file defines GimmeMusic's preview audio cache and its prefetcher.
+
+import hashlib
+import os
+import threading
+from urllib.parse import urlsplit
+
+from qtpy import QtCore
+
+import globalz
+from common import createSession, fakeUAHeader, getHostLimit, parallelMap, printline
+
+# Download chunk size (in bytes)
+chunksize = 1 << 16
+
+# Content types accepted as audio
+audiotypes = ('audio/', 'video/', 'application/octet-stream')
+
+# Lock for evicting files
+evictlock = threading.Lock()
+
+# Total size of the cached files (in bytes), None until the cache is scanned
+cachesize = None
+
+# Fraction of the size budget the cache is trimmed to when full, so that it isn't scanned again on every download
+trimratio = 0.9
+
+
+def getAudioPath(url: str) -> str:
+    """
+    Gets the cache path of an audio URL (named after its hash, keeping the extension).
+    """
+    ext = os.path.splitext(urlsplit(url).path)[1][:5]
+    return os.path.join(globalz.audiocachedir, hashlib.sha256(url.encode()).hexdigest() + ext)
+
+
+def getCachedAudio(url: str) -> str:
+    """
+    Returns the cached file for the given URL (marking it as recently used), or an empty string if not cached.
+    """
+    path = getAudioPath(url)
+    try:
+        os.utime(path)
+        return path
+    except OSError:
+        return ''
+
+
+def evictAudio(added: int) -> None:
+    """
+    Adds a downloaded file's size to the cache's total, deleting the least recently used files if it no longer fits in
+    its size budget. The cache is only scanned the first time and when files need to be deleted.
+    """
+    global cachesize
+    with evictlock:
+        budget = globalz.audiocachesize * 1024 * 1024
+        if cachesize is not None:
+            cachesize += added
+            if cachesize <= budget:
+                return
+
+        try:
+            files = [entry for entry in os.scandir(globalz.audiocachedir) if entry.is_file()]
+        except OSError:
+            return
+
+        # Sort files by last use, skipping partial downloads
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in files if not entry.name.endswith('.part'))
+        total = sum(size for mtime, size, path in files)
+        if total <= budget:
+            cachesize = total
+            return
+        for mtime, size, path in files:
+            if total <= budget * trimratio:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        cachesize = total
+
+
+class AudioPrefetcher(QtCore.QObject):
+    """
+    Downloads preview audio to the local cache (this runs on a separate thread from the GUI).
+    Interrupted downloads are resumed on the next run.
+    """
+    finished = QtCore.Signal()
+    textappended = QtCore.Signal(str)
+
+    def __init__(self, urls: list):
+        super().__init__()
+        self.urls = urls
+        self.terminate = False
+
+    def download(self, url: str) -> bool:
+        """
+        Downloads a single file, resuming the partial download if present.
+        """
+        path = getAudioPath(url)
+        partpath = path + '.part'
+        if self.terminate:
+            return False
+
+        try:
+            with getHostLimit(url):
+
+                # Request the missing part of the file
+                headers = fakeUAHeader
+                size = os.path.getsize(partpath) if os.path.isfile(partpath) else 0
+                if size:
+                    headers = fakeUAHeader | {'range': f'bytes={size}-'}
+
+                with self.session.get(url, headers=headers, timeout=(globalz.connecttimeout, globalz.readtimeout), stream=True) as r:
+
+                    # If the requested range is past the end, the partial file is already complete
+                    if r.status_code == 416 and size:
+                        os.replace(partpath, path)
+                        evictAudio(size)
+                        return True
+                    r.raise_for_status()
+
+                    # Skip links that aren't audio files (such as web pages)
+                    if not r.headers.get('content-type', '').startswith(audiotypes):
+                        return False
+
+                    # Append to the partial file if the server honoured the range, else start over
+                    with open(partpath, 'ab' if r.status_code == 206 else 'wb') as f:
+                        for chunk in r.iter_content(chunksize):
+                            if self.terminate:
+                                return False
+                            f.write(chunk)
+
+            # Complete the download
+            os.replace(partpath, path)
+            evictAudio(os.path.getsize(path))
+            return True
+
+        except OSError:  # requests' exceptions derive from it
+            return False
+
+    def run(self):
+
+        # Skip the files which are already cached
+        urls = [url for url in self.urls if not getCachedAudio(url)]
+        printline(self, 'Prefetching', len(urls), 'audio files...')
+        os.makedirs(globalz.audiocachedir, exist_ok=True)
+
+        # Download them concurrently
+        self.session = createSession()
+
+        downloaded = sum(parallelMap(self, self.download, urls))
+        self.session.close()
+        if self.terminate:
+            printline(self, 'Prefetch interrupted,', downloaded, 'audio files downloaded!')
+        else:
+            printline(self, 'Prefetch complete,', downloaded, 'audio files downloaded!')
+
+        # Emit event when done
+        self.finished.emit()
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# benchmark.py
+# This file measures GimmeMusic's startup time, so that regressions can be caught.
+#
+# Two things are measured, each in a fresh process:
+# - The import time of main.py, with a breakdown of its slowest imports (through python -X importtime)
+# - The time it takes for the main window to be shown and painted
+# The window is created offscreen by default (set QT_QPA_PLATFORM to use another Qt platform), with the
+# config, database and caches in a temporary folder, so that the user's files are left untouched.
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+
+# Program folder
+path = os.path.dirname(os.path.abspath(__file__))
+
+# Modules which must not be imported before scraping starts
+deferred = ('requests', 'bs4', 'cachecontrol', 'lxml', 'webcache')
+
+
+def runChild(*args: str) -> subprocess.CompletedProcess:
+    """
+    Runs Python in a fresh process from the program's folder.
+    """
+    env = os.environ.copy()
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return subprocess.run([sys.executable, *args], cwd=path, env=env, capture_output=True, text=True, check=True)
+
+
+def getImportTimes() -> list:
+    """
+    Imports main.py with -X importtime and returns the (self time, cumulative time, depth, module) tuples of main and
+    everything it imported, in microseconds.
+    """
+    times = []
+    for line in runChild('-X', 'importtime', '-c', 'import main').stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        selftime, cumulative, module = line[12:].split('|')
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        times.append((int(selftime), int(cumulative), depth, module.strip()))
+
+        # Modules are listed after their imports, so main comes last (this skips the interpreter's own imports)
+        if depth == 0:
+            if module.strip() == 'main':
+                return times
+            times = []
+    return times
+
+
+def measureWindow() -> None:
+    """
+    Starts the program like main.py does and prints the elapsed times as JSON (this runs in the child process).
+    """
+    start = time.perf_counter()
+    import globalz
+    import main
+    from qtpy import QtCore, QtWidgets
+    imported = time.perf_counter()
+
+    # Keep the program's files in a temporary folder
+    tempdir = tempfile.mkdtemp(prefix='gimmemusic-')
+    globalz.logfile = os.path.join(tempdir, 'log.txt')
+    globalz.configfile = os.path.join(tempdir, 'config.ini')
+    globalz.cachedir = os.path.join(tempdir, '.web_cache')
+    globalz.audiocachedir = os.path.join(tempdir, '.audio_cache')
+    globalz.dbfile = os.path.join(tempdir, 'gimmemusic.db')
+    globalz.sessionfile = os.path.join(tempdir, 'session.gms')
+
+    # Create the main window (it shows itself)
+    sys.path.append(globalz.modulefolder)
+    app = QtWidgets.QApplication([])
+    globalz.logbuffer = StringIO()
+    globalz.storage = main.Storage(globalz.dbfile)
+    globalz.library = main.SongLibrary(globalz.storage)
+    mw = main.MainWindow()
+    shown = time.perf_counter()
+
+    # Run the event loop until the pending events (including the first paint) are processed
+    QtCore.QTimer.singleShot(0, app.quit)
+    app.exec()
+    painted = time.perf_counter()
+
+    # Wait for the plugin scanner before quitting
+    while mw.thread:
+        app.processEvents()
+        time.sleep(0.01)
+
+    globalz.storage.close()
+    shutil.rmtree(tempdir, ignore_errors=True)
+    print(json.dumps({'import': imported - start, 'shown': shown - start, 'painted': painted - start}), flush=True)
+
+    # Skip the Qt teardown, it isn't part of the startup
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the startup time of GimmeMusic.')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='number of window startups to measure (default: 5)')
+    parser.add_argument('-t', '--top', type=int, default=10, help='number of slowest imports to list (default: 10)')
+    parser.add_argument('--window', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process mode
+    if args.window:
+        measureWindow()
+        return
+
+    # Import time breakdown
+    times = getImportTimes()
+    print(f'Import time of main.py: {times[-1][1] / 1000:.1f} ms')
+    print('Slowest imports (cumulative):')
+    toplevel = sorted((entry for entry in times if entry[2] == 1), key=lambda entry: entry[1], reverse=True)
+    for selftime, cumulative, depth, module in toplevel[:args.top]:
+        print(f'  {cumulative / 1000:8.1f} ms  {module}')
+
+    # Check that the scraping stack is still deferred
+    imported = sorted({module.split('.')[0] for selftime, cumulative, depth, module in times} & set(deferred))
+    if imported:
+        print('Warning! These modules should only be imported when scraping:', ', '.join(imported))
+
+    # Window startup time
+    results = [json.loads(runChild(__file__, '--window').stdout.splitlines()[-1]) for _ in range(args.runs)]
+    print(f'Window startup ({args.runs} runs, median / best):')
+    for key, name in (('import', 'Imports done'), ('shown', 'Window shown'), ('painted', 'First paint')):
+        values = [result[key] * 1000 for result in results]
+        print(f'  {name + ":":14} {statistics.median(values):7.1f} ms / {min(values):7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
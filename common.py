@@ -2,18 +2,67 @@
 
 # common.py
 # This file contains several functions that can be called by GimmeMusic plugins or the program itself.
+#
+# requests and BeautifulSoup are only imported on first use, so that they don't slow down the program's startup.
 
 import os
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup
 from qtpy import QtCore
-from requests import Response
+from qtpy.QtCore import Qt
 
 import globalz
 
 # Fake User Agent header for scraping, provided for convenience
 fakeUAHeader = {'user-agent': ''}
 
+# Locks for printing from multiple threads and for the per-host connection limits
+printlock = threading.Lock()
+hostlock = threading.Lock()
+hostlimits = {}
+
+# Thread pool running the requests, so that they can be abandoned when cancelled
+requestpool = ThreadPoolExecutor(globalz.maxworkers * 4, thread_name_prefix='request')
+
+# Stop flags of the parallelMap calls running the current thread (see isAbandoned)
+maplocal = threading.local()
+
+
+class CancelToken:
+    """
+    Cancellation flag shared by a worker and its requests.
+    Cancelling it stops the waits on running requests (see waitFuture) and closes the idle pooled connections of the
+    sessions in use. Requests already sent aren't interrupted, they finish in the background within the timeouts.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.sessions = weakref.WeakSet()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Checks if cancellation was requested.
+        """
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        """
+        Requests cancellation.
+        """
+        self.event.set()
+        for session in list(self.sessions):
+            session.close()
+
+    def addSession(self, session: 'requests.Session') -> None:
+        """
+        Registers a session, so that its idle connections are closed on cancellation.
+        """
+        self.sessions.add(session)
+
 
 def getMainWindow(self: QtCore.QObject) -> QtCore.QObject:
     """
@@ -33,26 +82,159 @@ def printline(self: QtCore.QObject, *args, **kwargs) -> None:
     if not self:
         return
 
-    # Empty the log buffer
-    globalz.logbuffer.seek(0)
-    globalz.logbuffer.truncate()
-
-    # Print to the buffer (replacing a couple of args)
-    kwargs |= {'end': '', 'file': globalz.logbuffer}
-    print(*args, **kwargs)
+    # Empty the log buffer and print to it (replacing a couple of args)
+    with printlock:
+        globalz.logbuffer.seek(0)
+        globalz.logbuffer.truncate()
+        kwargs |= {'end': '', 'file': globalz.logbuffer}
+        print(*args, **kwargs)
+        text = globalz.logbuffer.getvalue()
 
     # If the object calling this function has the textappended attribute, emit the signal
     if hasattr(self, 'textappended') and hasattr(self.textappended, 'emit') and callable(self.textappended.emit):
-        self.textappended.emit(globalz.logbuffer.getvalue())
+        self.textappended.emit(text)
 
     # Else get the main window and append the text
     else:
-        getMainWindow(self).centralWidget().console.textinput.append(globalz.logbuffer.getvalue())
+        getMainWindow(self).centralWidget().console.textinput.append(text)
+
+
+def getHostLimit(url: str) -> threading.BoundedSemaphore:
+    """
+    Gets the semaphore limiting the concurrent connections to the URL's host.
+    """
+    host = urlsplit(url).netloc
+    with hostlock:
+        if host not in hostlimits:
+            hostlimits[host] = threading.BoundedSemaphore(globalz.maxhostconns)
+        return hostlimits[host]
+
+
+class HostSlot:
+    """
+    Connection slot taken by a request running in the background (see getHostLimit).
+    It is only freed when the request completes, so that abandoned requests still count towards the host's limit while
+    they run. Abandoning it prevents a request that is still waiting for it from being sent.
+    """
+    def __init__(self, url: str):
+        self.limit = getHostLimit(url)
+        self.lock = threading.Lock()
+        self.held = False
+        self.abandoned = False
+
+    def acquire(self) -> bool:
+        """
+        Waits for a free slot, giving up if the request is abandoned meanwhile.
+        """
+        while not self.limit.acquire(timeout=globalz.pollinterval):
+            if self.abandoned:
+                return False
+        with self.lock:
+            if self.abandoned:
+                self.limit.release()
+                return False
+            self.held = True
+        return True
+
+    def release(self) -> None:
+        """
+        Frees the slot, if still held.
+        """
+        with self.lock:
+            if self.held:
+                self.held = False
+                self.limit.release()
+
+    def abandon(self) -> None:
+        """
+        Prevents the request from taking the slot, if it didn't yet.
+        """
+        self.abandoned = True
+
+
+def isAbandoned() -> bool:
+    """
+    Checks if the current thread runs an item of a parallelMap call whose loop was exited early.
+    """
+    return any(stopped.is_set() for stopped in getattr(maplocal, 'flags', ()))
+
+
+def waitFuture(self: QtCore.QObject, future: Future) -> bool:
+    """
+    Waits for a future to complete, giving up early if termination was invoked or its parallelMap item was abandoned.
+    Returns True if the future completed.
+    """
+    while not future.done():
+        if self.terminate or isAbandoned():
+            return False
+        wait((future,), globalz.pollinterval)
+    return True
+
+
+def parallelMap(self: QtCore.QObject, func: callable, items: object, workers: int = 0) -> object:
+    """
+    Calls func on each item from a thread pool, yielding the results in order.
+    Only a few items are queued ahead of the results; if the loop is exited early or termination was invoked,
+    the queued items are cancelled and the running ones are abandoned (their requests stop being waited for).
+    """
+    workers = workers or globalz.maxworkers
+    futures = deque()
+
+    # Let the items (and any nested parallelMap call) know when this call is stopped
+    stopped = threading.Event()
+    flags = getattr(maplocal, 'flags', ()) + (stopped,)
+
+    def runItem(item: object) -> object:
+        maplocal.flags = flags
+        return func(item)
+
+    pool = ThreadPoolExecutor(workers)
+    try:
+        for item in items:
+            futures.append(pool.submit(runItem, item))
+            if len(futures) >= workers * 2:
+                if not waitFuture(self, futures[0]):
+                    return
+                yield futures.popleft().result()
+                if self.terminate:
+                    return
+        while futures:
+            if not waitFuture(self, futures[0]):
+                return
+            yield futures.popleft().result()
+            if self.terminate:
+                return
+    finally:
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def createSession() -> 'requests.Session':
+    """
+    Creates a requests session with enough pooled connections for all the worker threads.
+    """
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=globalz.maxworkers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
-def openURL(self: QtCore.QObject, method: str, url: str, silent: bool = True, clearcookies: bool = False, headers: dict = fakeUAHeader, **kwargs) -> Response:
+def sendRequest(session: 'requests.Session', method: str, url: str, headers: dict, kwargs: dict, slot: HostSlot) -> 'requests.Response':
+    """
+    Makes a request once the host's connection slot is taken (it is freed by the caller when the request completes).
+    """
+    if not slot.acquire():
+        return None
+    return session.request(method, url, timeout=(globalz.connecttimeout, globalz.readtimeout), headers=headers, **kwargs)
+
+
+def openURL(self: QtCore.QObject, method: str, url: str, silent: bool = True, clearcookies: bool = False, headers: dict = fakeUAHeader, acceptstatus: tuple = (), session: 'requests.Session' = None, **kwargs) -> 'requests.Response':
     """
     Requests wrapper for plugin use.
+    Error status codes in acceptstatus are returned to the caller instead of failing.
+    A separate session (see createSession) can be given for requests relying on cookies, so that they can run in parallel.
     """
 
     # URL sanity check
@@ -65,23 +247,42 @@ def openURL(self: QtCore.QObject, method: str, url: str, silent: bool = True, cl
         printline(self, 'Termination request received, skipping...')
         return None
 
+    # Skip the request if its result is no longer needed
+    if isAbandoned():
+        return None
+
     # Try opening the url, catching any error
     try:
         if not silent:
             printline(self, f'Connecting to <i>{url}</i>...')
 
-        # Get the session
-        session = self.session
+        # Get the session, registering it for cancellation
+        if session is None:
+            session = self.session
+        if hasattr(self, 'token'):
+            self.token.addSession(session)
 
         # Clear cookies
         if clearcookies:
             session.cookies.clear()
 
-        # Make a request (timeout after 10 seconds, use fake UA)
-        r = session.request(method.upper(), url, timeout=10, headers=headers, **kwargs)
+        # Make a request in the background (use the configured timeouts and fake UA, respect the host's connection limit)
+        # Stop waiting for it as soon as termination is invoked or the result is no longer needed
+        # Abandoned requests keep their connection slot until they complete, and aren't sent if still waiting for one
+        slot = HostSlot(url)
+        future = requestpool.submit(sendRequest, session, method.upper(), url, headers, kwargs, slot)
+        future.add_done_callback(lambda future: slot.release())
+        if not waitFuture(self, future):
+            future.cancel()
+            slot.abandon()
+            if self.terminate:
+                printline(self, 'Termination request received, skipping...')
+            return None
+        r = future.result()
 
         # Raise an error if the status code is an error one
-        r.raise_for_status()
+        if r.status_code not in acceptstatus:
+            r.raise_for_status()
         return r
 
     except Exception as e:
@@ -89,9 +290,10 @@ def openURL(self: QtCore.QObject, method: str, url: str, silent: bool = True, cl
         return None
 
 
-def getWebPage(self: QtCore.QObject, r: Response) -> BeautifulSoup:
+def getWebPage(self: QtCore.QObject, r: 'requests.Response', parseonly: 'bs4.SoupStrainer' = None) -> 'bs4.BeautifulSoup':
     """
     BeautifulSoup wrapper for plugin use.
+    A SoupStrainer can be given to only parse the relevant parts of the page.
     """
     # Sanity check
     if not r:
@@ -105,12 +307,70 @@ def getWebPage(self: QtCore.QObject, r: Response) -> BeautifulSoup:
 
     # Attempt to parse the page
     try:
-        return BeautifulSoup(r.content, globalz.htmlparser)
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(r.content, globalz.htmlparser, parse_only=parseonly)
     except:
         printline(self, 'Failed to parse webpage!')
         return None
 
 
+def getPluginData(self: QtCore.QObject, key: str, default: object = None) -> object:
+    """
+    Gets a value stored by the running plugin in a previous run (for plugin use).
+    """
+    return globalz.storage.getValue(f'plugin/{self.current.modname}', key, default)
+
+
+def setPluginData(self: QtCore.QObject, key: str, value: object) -> None:
+    """
+    Stores a value for the running plugin, persisting it across runs (for plugin use).
+    """
+    globalz.storage.setValue(f'plugin/{self.current.modname}', key, value)
+
+
+def getReleaseDate(self: QtCore.QObject, url: str) -> QtCore.QDate:
+    """
+    Gets the release date stored for the running plugin's product page, or an invalid date if not found (for plugin use).
+    """
+    date = globalz.storage.getValue(f'releasedates/{self.current.modname}', url)
+    return QtCore.QDate.fromString(date, Qt.ISODate) if date else QtCore.QDate()
+
+
+def setReleaseDate(self: QtCore.QObject, url: str, date: QtCore.QDate) -> None:
+    """
+    Stores the release date of the running plugin's product page, so it doesn't need to be fetched again (for plugin use).
+    """
+    if date.isValid():
+        globalz.storage.setValue(f'releasedates/{self.current.modname}', url, date.toString(Qt.ISODate))
+
+
+def isBlacklisted(artist: str) -> bool:
+    """
+    Checks if the artist is blacklisted, so that plugins can skip it before getting the rest of the data (for plugin use).
+    """
+    return any(entry in artist for entry in globalz.blacklist)
+
+
+def isKnownRelease(self: QtCore.QObject, release: str, genres: list = None) -> bool:
+    """
+    Checks if the running plugin's release was scraped in a previous run and its songs are to be skipped (for plugin use).
+    If its songs are filtered by genre, pass the enabled genres: the release is only known if they were all enabled back then.
+    """
+    if not globalz.skipknown:
+        return False
+    scraped = globalz.storage.getValue(f'releases/{self.current.modname}', release)
+    if genres is None:
+        return scraped is not None
+    return isinstance(scraped, list) and set(genres) <= set(scraped)
+
+
+def setKnownRelease(self: QtCore.QObject, release: str, genres: list = None) -> None:
+    """
+    Records a release scraped by the running plugin, along with the enabled genres if its songs were filtered by them (for plugin use).
+    """
+    globalz.storage.setValue(f'releases/{self.current.modname}', release, True if genres is None else sorted(genres))
+
+
 def getAbsPath(path):
     """
     Gets a file inside the module folder.
@@ -120,16 +380,194 @@ def getAbsPath(path):
 
 def getLastUse() -> QtCore.QDate:
     """
-    Returns lastuse (for plugin use).
+    Returns lastuse, or the backfill start date if set (for plugin use).
     """
-    return globalz.lastuse
+    return globalz.backfill or globalz.lastuse
+
+
+def getDateRanges() -> list:
+    """
+    Returns the date range to scrape as (start, end) tuples (for plugin use).
+    When backfilling, the range ends at the backfill end date and is split into partitions that can be scraped independently.
+    """
+    start = getLastUse()
+    if not globalz.backfill:
+        return [(start, QtCore.QDate.currentDate())]
+    end = globalz.backfillend or QtCore.QDate.currentDate()
+
+    # Split the range from the newest partition to the oldest
+    ranges = []
+    while end >= start:
+        ranges.append((max(start, end.addDays(-globalz.backfilldays + 1)), end))
+        end = end.addDays(-globalz.backfilldays)
+    return ranges
 
 
 def verifyDate(date: QtCore.QDate) -> bool:
     """
     Verifies that the date given is in the user's allowed range.
     """
-    return date >= globalz.lastuse
+    return date >= getLastUse()
+
+
+def isAfterRange(date: QtCore.QDate) -> bool:
+    """
+    Checks if the date given is past the backfill end date, in which case the entry is to be skipped (for plugin use).
+    Listings sorted by date should keep going, as the entries in range come after it.
+    """
+    return bool(globalz.backfill and globalz.backfillend) and date > globalz.backfillend
+
+
+def findLastPage(self: QtCore.QObject, probe: callable, first: int = 1) -> int:
+    """
+    Finds the last page of a date-sorted listing that starts in the user's allowed range (for plugin use).
+    probe(page) must return True if the page exists and its first entry is in range. The page number is galloped
+    and then bisected, so only a logarithmic number of pages is probed; the pages up to the returned one can then
+    be scraped concurrently. Returns first - 1 if no page is in range.
+    """
+    if not probe(first):
+        return first - 1
+
+    # Double the distance until a page is out of range
+    low = first
+    high = first + 1
+    while not self.terminate and probe(high):
+        low = high
+        high = first + (high - first) * 2
+
+    # Then bisect between the last known page in range and the first one out of range
+    while not self.terminate and high - low > 1:
+        mid = (low + high) // 2
+        if probe(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def getListingPages(self: QtCore.QObject, getpage: callable, inrange: callable, first: int = 1, lazy: bool = False) -> object:
+    """
+    Yields the (page number, listing) tuples of a date-sorted listing, starting from the given page (for plugin use).
+    getpage(page) must return the page's listing, and inrange(listing) must return True if its first entry is in the
+    user's allowed range. If lazy is set (such as for incremental scrapes, which usually stop within the first pages),
+    the pages are fetched one at a time until the caller stops. Else the last page in range is found with findLastPage()
+    and the pages up to it are fetched concurrently. Stop iterating when a listing is empty.
+    """
+    if lazy:
+        page = first
+        while not self.terminate:
+            yield page, getpage(page)
+            page += 1
+        return
+
+    # Find the last page in range, keeping the probed pages for later
+    listings = {}
+    def probe(page: int) -> bool:
+        listings[page] = getpage(page)
+        return bool(listings[page]) and inrange(listings[page])
+    last = findLastPage(self, probe, first)
+
+    # Get the pages in range concurrently
+    pages = range(first, last + 1)
+    yield from zip(pages, parallelMap(self, lambda page: listings.pop(page, None) or getpage(page), pages))
+
+
+class Checkpoint:
+    """
+    Tracks the progress through a plugin's genre/category, so that interrupted scrapes can be resumed from the same page.
+    Skip the genre if done is set, else start from page. Call setPage() when loading a page, skip() on each listing entry
+    (skip it if it returns True), update() after processing it and finish() when done.
+    """
+    def __init__(self, scraper: QtCore.QObject, genre: str, category: str = ''):
+        self.scraper = scraper
+        self.modname = scraper.current.modname
+        self.key = '/'.join([genre, category])
+
+        # Restore the saved state
+        state = scraper.checkpoint.getGenre(self.modname, self.key)
+        self.done = state.get('done', False)
+        self.page = state.get('page', 1)
+        self.entries = state.get('entries', [])
+        self.resumed = set(self.entries)
+
+    def setPage(self, page: object) -> None:
+        """
+        Saves the page being scraped.
+        """
+        if page != self.page:
+            self.page = page
+            self.entries = []
+            self.resumed = set()
+        self.scraper.checkpoint.setGenre(self.modname, self.key, {'page': self.page, 'entries': list(self.entries)}, True)
+
+    def skip(self, entry: str) -> bool:
+        """
+        Checks if the entry was processed before the interruption.
+        """
+        return entry in self.resumed
+
+    def update(self, entry: str) -> None:
+        """
+        Records a processed entry.
+        """
+        self.entries.append(entry)
+        self.scraper.checkpoint.setGenre(self.modname, self.key, {'page': self.page, 'entries': list(self.entries)})
+
+    def finish(self) -> None:
+        """
+        Marks the genre as completed, unless the scrape was interrupted.
+        """
+        if not self.scraper.terminate:
+            self.scraper.checkpoint.setGenre(self.modname, self.key, {'done': True}, True)
+
+
+class Watermark:
+    """
+    Remembers the newest entries of a plugin's genre/category across runs, so that incremental scrapes can stop early.
+    Call reached() on each listing entry (stop if it returns True), update() after processing it and commit() when done.
+    Watermarks are neither used nor updated when backfilling.
+    """
+    def __init__(self, scraper: QtCore.QObject, genre: str, category: str = ''):
+        self.scraper = scraper
+        self.key = '/'.join([scraper.current.modname, genre, category])
+        self.window = globalz.lastuse.toString(Qt.ISODate)
+        self.newest = []
+        self.hit = False
+
+        # Only use the stored entries if the previous runs reached at least the current date cutoff
+        data = globalz.storage.getValue('watermarks', self.key, {})
+        self.entries = data.get('entries', [])
+        self.oldwindow = data.get('window', self.window)
+        self.active = globalz.incremental and not globalz.backfill and bool(self.entries) and self.oldwindow <= self.window
+
+    def reached(self, entry: str) -> bool:
+        """
+        Checks if the entry was already seen in a previous run (if incremental scraping is enabled).
+        """
+        if self.active and entry in self.entries:
+            self.hit = True
+        return self.hit
+
+    def update(self, entry: str) -> None:
+        """
+        Records a processed entry. Only the newest ones are kept.
+        """
+        if len(self.newest) < globalz.watermarkcount and entry not in self.newest:
+            self.newest.append(entry)
+
+    def commit(self) -> None:
+        """
+        Stores the newest entries, unless the scrape was interrupted.
+        """
+        if not self.newest or self.scraper.terminate or globalz.backfill:
+            return
+
+        # Pad the list with the previous entries, in case the newest ones get removed from the website
+        entries = self.newest + [entry for entry in self.entries if entry not in self.newest]
+        data = {'entries': entries[:globalz.watermarkcount],
+                'window': self.oldwindow if self.hit else self.window,
+                'time': QtCore.QDateTime.currentDateTime().toString(Qt.ISODate)}
+        globalz.storage.setValue('watermarks', self.key, data)
 
 
 if __name__ == '__main__':
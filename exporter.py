@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# exporter.py
+# This file defines GimmeMusic's playlist export formats and the export worker.
+
+import json
+import os
+from html import escape
+
+from qtpy import QtCore
+
+from common import printline
+from scraping import Song
+
+# Export chunk size (in entries) and file buffer size (in bytes)
+chunksize = 1024
+buffersize = 1 << 20
+
+
+def m3uEntry(song: Song, source: str) -> str:
+    """
+    Formats a M3U entry.
+    """
+    album = f' ({song.album})' if song.album else ''
+    return f'#EXTINF:-1,{song.artist} - {song.name}{album}\n{song.audiourl}\n'
+
+
+def xspfEntry(song: Song, source: str) -> str:
+    """
+    Formats a XSPF track.
+    """
+    return (f'    <track>\n'
+            f'      <location>{escape(song.audiourl, False)}</location>\n'
+            f'      <title>{escape(song.name, False)}</title>\n'
+            f'      <creator>{escape(song.artist, False)}</creator>\n'
+            f'      <album>{escape(song.album, False)}</album>\n'
+            f'      <annotation>{escape(song.genre, False)}</annotation>\n'
+            f'    </track>\n')
+
+
+def jsonlEntry(song: Song, source: str) -> str:
+    """
+    Formats a JSON line.
+    """
+    data = {'name': song.name, 'artist': song.artist, 'album': song.album, 'genre': song.genre, 'audiourl': song.audiourl, 'source': source}
+    return json.dumps(data, ensure_ascii=False) + '\n'
+
+
+# Export formats, as extension: (name, header, entry function, footer, appendable)
+formats = {
+    '.m3u': ('M3U Playlists', '#EXTM3U\n', m3uEntry, '', True),
+    '.xspf': ('XSPF Playlists', '<?xml version="1.0" encoding="UTF-8"?>\n<playlist version="1" xmlns="http://xspf.org/ns/0/">\n  <trackList>\n', xspfEntry, '  </trackList>\n</playlist>\n', False),
+    '.jsonl': ('JSON Lines', '', jsonlEntry, '', True),
+}
+
+
+def getFormat(file: str) -> tuple:
+    """
+    Gets the export format from the file extension, defaulting to M3U.
+    """
+    for ext, fmt in formats.items():
+        if file.lower().endswith(ext):
+            return fmt
+    return formats['.m3u']
+
+
+def getFileFilter(appendable: bool = False) -> str:
+    """
+    Builds the file dialog filter for the export formats.
+    """
+    return ';;'.join(f'{fmt[0]} (*{ext})' for ext, fmt in formats.items() if fmt[4] or not appendable)
+
+
+class PlaylistExporter(QtCore.QObject):
+    """
+    Playlist exporter (this runs on a separate thread from the GUI).
+    """
+    finished = QtCore.Signal()
+    textappended = QtCore.Signal(str)
+    exported = QtCore.Signal(list)
+
+    def __init__(self, file: str, entries: list):
+        """
+        Takes the destination file and a snapshot of the (song, source) tuples to export.
+        """
+        super().__init__()
+        self.file = file
+        self.entries = entries
+        self.terminate = False
+
+    def run(self):
+        printline(self, 'Exporting playlist to', self.file + '...')
+        name, header, entry, footer, appendable = getFormat(self.file)
+
+        # Write the entries in chunks through a large buffer
+        try:
+            with open(self.file, 'w', encoding='utf-8', errors='replace', buffering=buffersize) as f:
+                f.write(header)
+                for i in range(0, len(self.entries), chunksize):
+                    if self.terminate:
+                        break
+                    f.write(''.join(entry(song, source) for song, source in self.entries[i:i + chunksize]))
+                f.write(footer)
+
+            # Report the exported songs, or remove the incomplete file if the export was stopped
+            if self.terminate:
+                os.remove(self.file)
+                printline(self, 'Export interrupted!')
+            else:
+                printline(self, 'Export complete!')
+                self.exported.emit([song for song, source in self.entries])
+        except Exception as e:
+            printline(self, 'Failed to export playlist:', e)
+
+        # Emit event when done
+        self.finished.emit()
+
+
+class LiveExporter:
+    """
+    Appends songs to a playlist file as they are found, so that players can pick them up during the scrape.
+    Formats with a footer (such as XSPF) are only complete once the exporter is closed.
+    """
+    def __init__(self, file: str):
+        name, header, self.entry, self.footer, appendable = getFormat(file)
+        self.file = open(file, 'w', encoding='utf-8', errors='replace')
+        self.file.write(header)
+        self.file.flush()
+
+    def add(self, song: Song, source: str) -> None:
+        """
+        Appends a song to the file.
+        """
+        self.file.write(self.entry(song, source))
+        self.file.flush()
+
+    def close(self) -> None:
+        """
+        Writes the footer and closes the file.
+        """
+        try:
+            self.file.write(self.footer)
+        finally:
+            self.file.close()
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
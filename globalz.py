@@ -15,17 +15,60 @@ logbuffer = None
 # Date for scraping and settings
 lastuse = None
 
+# Persistent storage and song library
+storage = None
+library = None
+
+# Incremental scraping (stop at entries seen in previous runs)
+incremental = False
+
+# Skip songs already found in previous runs
+skipknown = False
+
+# Blacklisted artists
+blacklist = []
+
+# Backfill start date (overrides lastuse when set), end date and partition size (in days)
+backfill = None
+backfillend = None
+backfilldays = 7
+
+# Audio cache size budget (in MB) and usage of the cached files in exports
+audiocachesize = 1024
+exportlocal = False
+
 # Files/folders
 path = os.path.dirname(os.path.abspath(__file__))
 logfile = os.path.join(path, 'log.txt')
 configfile = os.path.join(path, 'config.ini')
 modulefolder = os.path.join(path, 'modules')
 cachedir = os.path.join(path, '.web_cache')
+audiocachedir = os.path.join(path, '.audio_cache')
+dbfile = os.path.join(path, 'gimmemusic.db')
+sessionfile = os.path.join(path, 'session.gms')
 
 # Variables
 pluginmeta = 'gimmeplugin'
 mainfunc = 'scrapeMain'
 scanfunc = 'scanMain'
+watermarkcount = 10
+librarybatch = 500
+
+# Concurrency limits
+maxworkers = 8
+maxhostconns = 4
+
+# Interval for checking cancellation while waiting (in seconds)
+pollinterval = 0.05
+
+# Request timeouts (in seconds) and time budgets for each plugin and the whole run (in minutes, 0 means unlimited)
+connecttimeout = 5
+readtimeout = 10
+plugintimeout = 0
+runtimeout = 0
+
+# Link check cache duration (in seconds)
+linkcheckttl = 86400
 defaultUA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.193 Safari/537.36 Edg/86.0.622.68'
 
 
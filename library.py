@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# library.py
+# This file defines GimmeMusic's song library, which keeps track of the songs found across runs.
+
+import re
+import sqlite3
+
+from scraping import Song
+from storage import Storage
+
+# Columns returned by queries, in Song order
+songcolumns = 'name, artist, album, genre, audiourl, source'
+
+
+def normalize(text: str) -> str:
+    """
+    Normalizes a name for duplicate detection (case and whitespace insensitive).
+    """
+    return ' '.join(text.casefold().split())
+
+
+class SongLibrary:
+    """
+    Persistent song library, stored in the program's database.
+    """
+    def __init__(self, storage: Storage):
+        self.lock = storage.lock
+        self.db = storage.db
+
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS songs (
+                                id INTEGER PRIMARY KEY,
+                                name TEXT NOT NULL,
+                                artist TEXT NOT NULL,
+                                album TEXT,
+                                genre TEXT,
+                                audiourl TEXT,
+                                source TEXT,
+                                normname TEXT NOT NULL,
+                                normartist TEXT NOT NULL,
+                                added TEXT DEFAULT CURRENT_TIMESTAMP,
+                                exported INTEGER DEFAULT 0)''')
+            self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS songs_norm ON songs (normartist, normname)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS songs_audiourl ON songs (audiourl)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS songs_source ON songs (source)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS songs_exported ON songs (exported)')
+
+            # Set up the full-text index if SQLite supports it, else fall back to plain searches
+            try:
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(name, artist, album, genre, content='songs', content_rowid='id')")
+                self.db.execute('''CREATE TRIGGER IF NOT EXISTS songs_ai AFTER INSERT ON songs BEGIN
+                                    INSERT INTO songs_fts (rowid, name, artist, album, genre) VALUES (new.id, new.name, new.artist, new.album, new.genre);
+                                   END''')
+                self.db.execute('''CREATE TRIGGER IF NOT EXISTS songs_ad AFTER DELETE ON songs BEGIN
+                                    INSERT INTO songs_fts (songs_fts, rowid, name, artist, album, genre) VALUES ('delete', old.id, old.name, old.artist, old.album, old.genre);
+                                   END''')
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+
+    def isKnown(self, song: Song) -> bool:
+        """
+        Checks if the song was already found in a previous run.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM songs WHERE normartist = ? AND normname = ?', (normalize(song.artist), normalize(song.name))).fetchone()
+        return bool(row)
+
+    def addSongs(self, entries: list) -> None:
+        """
+        Adds a list of (song, source) tuples to the library in a single transaction. Known songs are ignored.
+        """
+        rows = [(song.name, song.artist, song.album, song.genre, song.audiourl, source, normalize(song.name), normalize(song.artist)) for song, source in entries]
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR IGNORE INTO songs (name, artist, album, genre, audiourl, source, normname, normartist) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def markExported(self, songs: list) -> None:
+        """
+        Marks the given songs as exported.
+        """
+        rows = [(normalize(song.artist), normalize(song.name)) for song in songs]
+        with self.lock, self.db:
+            self.db.executemany('UPDATE songs SET exported = 1 WHERE normartist = ? AND normname = ?', rows)
+
+    def getNewSongs(self) -> list:
+        """
+        Returns the (song, source) tuples of the songs that were never exported.
+        """
+        with self.lock:
+            rows = self.db.execute(f'SELECT {songcolumns} FROM songs WHERE exported = 0 ORDER BY id').fetchall()
+        return [(Song(*row[:5]), row[5]) for row in rows]
+
+    def search(self, query: str) -> list:
+        """
+        Returns the (song, source) tuples matching the given words in their name, artist, album or genre.
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+
+        with self.lock:
+            if self.fts:
+                match = ' '.join(f'"{word}"*' for word in words)
+                rows = self.db.execute(f'SELECT {songcolumns} FROM songs WHERE id IN (SELECT rowid FROM songs_fts WHERE songs_fts MATCH ?) ORDER BY id', (match,)).fetchall()
+            else:
+                condition = ' AND '.join(["(name || ' ' || artist || ' ' || album || ' ' || genre) LIKE ?"] * len(words))
+                rows = self.db.execute(f'SELECT {songcolumns} FROM songs WHERE {condition} ORDER BY id', [f'%{word}%' for word in words]).fetchall()
+        return [(Song(*row[:5]), row[5]) for row in rows]
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
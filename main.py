@@ -10,7 +10,9 @@ if sys.version_info < (3, 7):
     raise Exception('Please update your copy of Python to 3.7 or greater. Currently running on: ' + sys.version.split()[0])
 
 # Standard imports
+import os
 import traceback
+from importlib.util import find_spec
 from io import StringIO
 
 # If any other error occurs, let QtPy throw its own exceptions without intervention
@@ -20,19 +22,14 @@ try:
 except ImportError:
     raise Exception('QtPy is not installed in this Python environment. Go online and download it.')
 
-try:
-    import requests
-except ImportError:
+# The scraping dependencies are only imported when scraping starts, so just check that they're installed
+if not find_spec('requests'):
     raise Exception('requests is not installed in this Python environment. Go online and download it.')
 
-try:
-    import cachecontrol
-except ImportError:
+if not find_spec('cachecontrol'):
     raise Exception('cachecontrol is not installed in this Python environment. Go online and download it.')
 
-try:
-    from bs4 import BeautifulSoup
-except ImportError:
+if not find_spec('bs4'):
     raise Exception('BeautifulSoup4 is not installed in this Python environment. Go online and download it.')
 
 # Local imports
@@ -41,10 +38,13 @@ try:
     import globalz
     from common import getMainWindow, printline
     from console import Console
+    from exporter import getFileFilter
     from playlist import Playlist
     from plugin import PluginScanner, Plugin
-    from scraping import SongScraper
-    from settings import Settings, readconfig, writeconfig
+    from scraping import ScrapeCheckpoint, SongScraper
+    from library import SongLibrary
+    from settings import Settings, readconfig, readpluginconfig, writeconfig
+    from storage import Storage
 except ImportError:
     raise Exception("One or more program components are missing! Quitting...")
 
@@ -105,8 +105,14 @@ class MainWidget(QtWidgets.QWidget):
             mw.stopscrape.emit()
             self.startButton.setEnabled(False)
         else:
+            # Offer to resume the last scrape if it was interrupted
+            resume = False
+            if ScrapeCheckpoint.exists():
+                answer = QtWidgets.QMessageBox.question(self, 'Resume Scrape?', 'The last scrape was interrupted. Resume it?')
+                resume = answer == QtWidgets.QMessageBox.Yes
+
             self.startButton.setText('STOP')
-            mw.runThread(False)
+            mw.runThread(False, resume)
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -154,11 +160,17 @@ class MainWindow(QtWidgets.QMainWindow):
         # Show the window
         self.show()
 
-        # Attempt to import lxml
-        try:
-            import lxml
+        # Restore the last session
+        if os.path.isfile(globalz.sessionfile):
+            try:
+                self.centralWidget().plist.loadSession(globalz.sessionfile)
+            except Exception as e:
+                printline(self, 'Failed to restore the last session:', e)
+
+        # Look for lxml (BeautifulSoup imports it when parsing)
+        if find_spec('lxml'):
             globalz.htmlparser = 'lxml'
-        except ImportError:
+        else:
             printline('lxml not found, falling back to html.parser...')
 
         # Run the plugin scanner
@@ -175,8 +187,23 @@ class MainWindow(QtWidgets.QMainWindow):
         preficon = self.style().standardIcon(QtWidgets.QStyle.StandardPixmap.SP_FileDialogDetailedView)
         closeicon = self.style().standardIcon(QtWidgets.QStyle.StandardPixmap.SP_DialogCancelButton)
         file.addAction(preficon ,'Preferences', self.openSettings, 'CTRL+P')
+        file.addAction('Open Session', self.openSession, 'CTRL+O')
+        file.addAction('Save Session', self.saveSession, 'CTRL+S')
+        self.liveExportAction = file.addAction('Live Export', self.toggleLiveExport, 'CTRL+L')
+        self.liveExportAction.setCheckable(True)
         file.addAction(closeicon, 'Exit', self.close, 'CTRL+Q')
 
+        # Playlist Menu
+        playlist = bar.addMenu('Playlist')
+        playlist.addAction('Validate Links', lambda: self.centralWidget().plist.validateLinks(), 'CTRL+K')
+        playlist.addAction('Prefetch Audio', lambda: self.centralWidget().plist.prefetchAudio(), 'CTRL+D')
+        playlist.addAction('Stop Task', lambda: self.centralWidget().plist.stopTask(), 'CTRL+T')
+
+        # Library Menu
+        library = bar.addMenu('Library')
+        library.addAction('Load New Songs', lambda: self.centralWidget().plist.loadNewSongs(), 'CTRL+N')
+        library.addAction('Search History', lambda: self.centralWidget().plist.searchLibrary(), 'CTRL+F')
+
     def openSettings(self):
         """
         Opens the settings if a secondary thread isn't running.
@@ -186,15 +213,61 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             Settings(self).exec()
 
-    def runThread(self, isScan: bool):
+    def openSession(self):
         """
-        Runs either the plugin scanner or the scraper, depending on the bool.
+        Loads a playlist session chosen by the user, if a scrape isn't running.
+        """
+        if self.thread and self.thread.isRunning():
+            QtWidgets.QMessageBox.warning(self, 'Task Running!', 'Please stop the task or wait for it to finish first.')
+            return
+
+        file = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Session', '', 'Sessions (*.gms);;')[0]
+        if file:
+            try:
+                self.centralWidget().plist.loadSession(file)
+                printline(self, 'Loaded session', file + '!')
+            except Exception as e:
+                printline(self, 'Failed to load session:', e)
+
+    def saveSession(self):
+        """
+        Saves the playlist to a session file chosen by the user.
+        """
+        file = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Session', 'session.gms', 'Sessions (*.gms);;')[0]
+        if file:
+            try:
+                self.centralWidget().plist.saveSession(file)
+                printline(self, 'Saved session to', file + '!')
+            except Exception as e:
+                printline(self, 'Failed to save session:', e)
+
+    def toggleLiveExport(self, enabled: bool):
+        """
+        Starts or stops appending the songs found to a playlist file chosen by the user.
+        """
+        plist = self.centralWidget().plist
+        if not enabled:
+            plist.stopLiveExport()
+            return
+
+        file = QtWidgets.QFileDialog.getSaveFileName(self, 'Live Export', 'live.m3u', getFileFilter(True))[0]
+        try:
+            if file:
+                plist.startLiveExport(file)
+                return
+        except Exception as e:
+            printline(self, 'Failed to start live export:', e)
+        self.liveExportAction.setChecked(False)
+
+    def runThread(self, isScan: bool, resume: bool = False):
+        """
+        Runs either the plugin scanner or the scraper (optionally resuming the last scrape), depending on the bool.
         """
         self.thread = QtCore.QThread(self)
         if isScan:
             self.worker = PluginScanner()
         else:
-            self.worker = SongScraper(self)
+            self.worker = SongScraper(self, resume)
             self.centralWidget().plist.tree.setSortingEnabled(False)
 
         # Move worker to thread
@@ -215,6 +288,8 @@ class MainWindow(QtWidgets.QMainWindow):
             self.thread.finished.connect(self.endPluginScan)
         else:
             self.worker.songfound.connect(self.centralWidget().plist.addEntry)
+            self.worker.songsrestored.connect(self.centralWidget().plist.restoreEntries)
+            self.centralWidget().plist.checkpoint = self.worker.checkpoint
             self.thread.finished.connect(self.endScraping)
 
         # Start the thread!
@@ -228,12 +303,8 @@ class MainWindow(QtWidgets.QMainWindow):
             self.modulelist[plugin.modname] = plugin
             printline(self, 'Found plugin', f'{plugin.modname}.py!')
 
-            # Enable it if the config says so
-            plugin.enabled = self.config.value(f'Plugins/{plugin.modname}', 'false') == 'true'
-            if plugin.genres:
-                for genre in plugin.genres:
-                    confkey = f'{plugin.modname}_{genre}'
-                    plugin.genres[genre] = self.config.value(f'Plugins/{confkey}', 'false') == 'true'
+            # Enable it and its genres if the config says so
+            readpluginconfig(self.config, plugin)
 
 
     def endPluginScan(self):
@@ -263,8 +334,14 @@ class MainWindow(QtWidgets.QMainWindow):
         plist = self.centralWidget().plist
         plist.tree.setSortingEnabled(True)
 
-        # Update buttons
+        # Update buttons and save the new songs to the library
         plist.updateButtons()
+        plist.saveToLibrary()
+
+        # Save the songs added after the scraper's last checkpoint save, if the scrape can be resumed
+        if ScrapeCheckpoint.exists():
+            plist.checkpoint.save()
+        plist.checkpoint = None
 
         # Unset thread and worker
         self.thread = None
@@ -272,13 +349,23 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def closeEvent(self, e: QtGui.QCloseEvent):
         """
-        Override the close event to prevent closing during a task (or to save the configuration if none is running).
+        Override the close event to prevent closing during a scrape (or to stop any playlist task and save the configuration).
         """
+        plist = self.centralWidget().plist
         if self.thread and self.thread.isRunning():
             QtWidgets.QMessageBox.warning(self, 'Task Running!', 'Please stop the task or wait for it to finish first.')
             e.ignore()
         else:
+            plist.stopTask(True)
+            plist.stopLiveExport()
             writeconfig(self.config, self.modulelist, self.saveGeometry(), self.saveState(), self.centralWidget().splitter.saveState())
+
+            # Save the session, warning the user on failure (the previous session file is left intact)
+            try:
+                plist.saveSession(globalz.sessionfile)
+            except Exception as ex:
+                printline(self, 'Failed to save the session:', ex)
+                QtWidgets.QMessageBox.warning(self, 'Session Not Saved!', f'Failed to save the session:\n{ex}')
             super().closeEvent(e)
 
 
@@ -297,12 +384,17 @@ def main():
     # Set up the log buffer
     globalz.logbuffer = StringIO()
 
+    # Open the persistent storage
+    globalz.storage = Storage(globalz.dbfile)
+    globalz.library = SongLibrary(globalz.storage)
+
     # Run the app
     mw = MainWindow()
     ret = app.exec()
 
-    # Close the log buffer
+    # Close the log buffer and the storage
     globalz.logbuffer.close()
+    globalz.storage.close()
 
     # Quit the process
     sys.exit(ret)
@@ -9,42 +9,67 @@ import os
 from bs4 import NavigableString
 from qtpy import QtCore
 
-from common import getAbsPath, getLastUse, getWebPage, printline, openURL
-from plugin import Plugin
+from common import Checkpoint, Watermark, getAbsPath, getDateRanges, getPluginData, getWebPage, isKnownRelease, parallelMap, printline, openURL, setKnownRelease, setPluginData
+from plugin import Plugin, PluginScanner
 from scraping import Song, SongScraper
 
-genredata = None
+# Genre data and its compiled index (loaded on first use, and stored with the plugin data)
+genrefile = getAbsPath('beatportgenres.json')
+genreindex = None
 
-# Open and parse the genre data
-def createGenreData() -> list:
-    global genredata
 
-    # Check if the file exists
-    genrefile = getAbsPath('beatportgenres.json')
-    if not os.path.isfile(genrefile):
-        raise Exception('Genre file not found!')
+# Compile the genre data into an index
+def compileGenreIndex(mtime: float) -> dict:
 
-    # Read it (do not catch exceptions, let the plugin scanner do that)
+    # Read the genre data
     with open(genrefile) as f:
-        data = f.read()
-    genredata = json.loads(data)
+        genredata = json.load(f)
 
-    # Parse it
-    results = []
+    # Map each main genre to its URL data, each genre/subgenre to the main genres containing it,
+    # and each original name to its lowercase version
+    genres = {}
+    parents = {}
+    lookup = {}
     for genre in genredata['results']:
-        results.append(genre['name'].lower())
+        name = genre['name'].lower()
+        genres[name] = {'name': genre['name'], 'id': genre['id'], 'slug': genre['slug']}
+        parents.setdefault(name, []).append(name)
+        lookup[genre['name']] = name
         for subgenre in genre['sub_genres']:
-            subgenre = subgenre['name'].lower()
-            if subgenre not in results:
-                results.append(subgenre)
+            subname = subgenre['name'].lower()
+            if name not in parents.setdefault(subname, []):
+                parents[subname].append(name)
+            lookup[subgenre['name']] = subname
+
+    return {'mtime': mtime, 'genres': genres, 'parents': parents, 'lookup': lookup}
+
+
+# Get the genre index, using the stored one if the genre data didn't change
+def getGenreIndex(self: QtCore.QObject) -> dict:
+    global genreindex
+
+    # Check if the file exists
+    if not os.path.isfile(genrefile):
+        raise Exception('Genre file not found!')
+
+    # Reuse the loaded index if still valid
+    mtime = os.path.getmtime(genrefile)
+    if genreindex and genreindex['mtime'] == mtime:
+        return genreindex
+
+    # Else try the stored one
+    genreindex = getPluginData(self, 'genreindex')
+    if genreindex and genreindex.get('mtime') == mtime:
+        return genreindex
 
-    # Sort it and return it
-    results.sort()
-    return results
+    # Else compile it again and store it
+    genreindex = compileGenreIndex(mtime)
+    setPluginData(self, 'genreindex', genreindex)
+    return genreindex
 
 
 gimmeplugin = {'name': 'Beatport',
-                 'genres': createGenreData(),
+                 'files': ['beatportgenres.json'],
                  'author': 'CLF78',
                  'version': '1.0',
                  'description': 'The world\'s largest store for DJs.'}
@@ -53,71 +78,124 @@ baseURL='https://www.beatport.com/genre/%s/%d/releases?page=%d&sort=release-desc
 downloadURL = 'https://www.beatport.com/api/releases/%s/tracks'
 
 
-def getTrackGenre(modulegenres: dict, track: dict) -> str:
+def getTrackGenre(modulegenres: dict, lookup: dict, track: dict) -> str:
     """
     Checks if the subgenre is enabled (or the genre if no subgenres are present).
     """
     genrelist = track['sub_genres'] if track['sub_genres'] else track['genres']
     for genre in genrelist:
         genre = genre['name']
-        if modulegenres[genre.lower()]:
+        if modulegenres.get(lookup.get(genre) or genre.lower()):
             return genre
     return ''
 
 
-def scrapeGenre(scraper: SongScraper, modulegenres: dict, genreJson: dict, startDate: str, endDate: str, page: int = 1) -> None:
+def parseRelease(scraper: SongScraper, modulegenres: dict, tracks: list) -> list:
+    """
+    Gets the songs of a release from its API response.
+    """
+    songs = []
+    for track in tracks:
+
+        # Subgenre/genre checks
+        # If the track has subgenres and none of them is enabled, skip entry
+        genre = getTrackGenre(modulegenres, genreindex['lookup'], track)
+        if not genre:
+            printline(scraper, 'Genre/subgenre not enabled. Skipping...')
+            continue
+
+        # Check if available for preview
+        audiourl = track['preview']['mp3']['url']
+        if not audiourl:
+            audiourl = track['preview']['mp4']['url']
+        if not audiourl:
+            continue
+
+        # Get the remaining metadata
+        name = track['name']
+        mix = track['mix']
+        if mix:
+            name += f' ({mix})'
+
+        artists = [artist['name'] for artist in track['artists']]
+        artists += [remixer['name'] for remixer in track['remixers']]
+
+        album = track['release']['name']
+        songs.append(Song(name, ', '.join(artists), album, genre, audiourl))
+    return songs
+
+
+def scrapeGenre(scraper: SongScraper, modulegenres: dict, genreJson: dict, startDate: str, endDate: str, wm: Watermark, cp: Checkpoint, fetched: set, page: int = 1) -> None:
 
     # Get the releases page
+    cp.setPage(page)
     wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genreJson['slug'], genreJson['id'], page, startDate, endDate), silent=False, clearcookies=True))
     if not wp:
         return
 
     # Get the release table using a CSS selector, then iterate through it
     table = wp.body.select_one('.filter-page-releases-list.ec-bucket.bucket-items').contents
+    ids = []
+    reached = False
+    genres = [genre for genre, enabled in modulegenres.items() if enabled]
     for entry in table:
 
         # Skip strings
         if type(entry) == NavigableString:
             continue
 
-        # Get API response
+        # Skip the release if it was processed before the interruption
         printline(scraper, 'Parsing entry...')
         id = entry['data-ec-id']
-        resp = openURL(scraper, 'get', downloadURL % id)
-        if not resp:
-            return
+        if cp.skip(id):
+            continue
 
-        # Get all the metadata
-        resp = resp.json()
-        for track in resp['tracks']:
+        # Stop if the release was already scraped in a previous run
+        if wm.reached(id):
+            printline(scraper, 'Reached previously scraped entries. Moving on...')
+            reached = True
+            break
+
+        # Skip the release if it was already fetched under another genre
+        if id in fetched:
+            printline(scraper, 'Release already fetched. Skipping...')
+            wm.update(id)
+            cp.update(id)
+            continue
 
-            # Subgenre/genre checks
-            # If the track has subgenres and none of them is enabled, skip entry
-            genre = getTrackGenre(modulegenres, track)
-            if not genre:
-                printline(scraper, 'Genre/subgenre not enabled. Skipping...')
-                continue
+        # Skip the release if it was scraped in a previous run (with the same genres enabled, as they filter its tracks)
+        if isKnownRelease(scraper, id, genres):
+            printline(scraper, 'Release found in a previous run. Skipping...')
+            wm.update(id)
+            cp.update(id)
+            continue
+        ids.append(id)
 
-            # Check if available for preview
-            audiourl = track['preview']['mp3']['url']
-            if not audiourl:
-                audiourl = track['preview']['mp4']['url']
-            if not audiourl:
-                continue
+    # Get the API responses concurrently, processing them in listing order
+    for id, resp in zip(ids, parallelMap(scraper, lambda id: openURL(scraper, 'get', downloadURL % id), ids)):
+        if not resp:
+            continue
 
-            # Get the remaining metadata
-            name = track['name']
-            mix = track['mix']
-            if mix:
-                name += f' ({mix})'
+        # Get all the metadata, skipping the release if the response is malformed
+        try:
+            songs = parseRelease(scraper, modulegenres, resp.json()['tracks'])
+        except (ValueError, KeyError, TypeError) as e:
+            printline(scraper, 'Failed to parse release', id + ':', e)
+            continue
 
-            artists = [artist['name'] for artist in track['artists']]
-            artists += [remixer['name'] for remixer in track['remixers']]
+        # Emit events
+        for song in songs:
+            scraper.songfound.emit(song, 'Beatport')
 
-            album = track['release']['name']
+        # Save the progress (only now that the release was processed)
+        fetched.add(id)
+        setKnownRelease(scraper, id, genres)
+        wm.update(id)
+        cp.update(id)
 
-            # Emit event
-            scraper.songfound.emit(Song(name, ', '.join(artists), album, genre, audiourl), 'Beatport')
+    # Stop if the previously scraped entries were reached
+    if reached:
+        return
 
     # Check if it's the last page, and if so return
     pagenum = wp.select_one('.pagination-top-container.pagination-container > .pag-num-list-container')
@@ -125,30 +203,69 @@ def scrapeGenre(scraper: SongScraper, modulegenres: dict, genreJson: dict, start
         return
 
     # Else call this recursively
-    scrapeGenre(scraper, modulegenres, genreJson, startDate, endDate, page + 1)
+    scrapeGenre(scraper, modulegenres, genreJson, startDate, endDate, wm, cp, fetched, page + 1)
+
+
+def scrapeRange(scraper: SongScraper, modulegenres: dict, genreJson: dict, dates: tuple, wm: Watermark, fetched: set, partitioned: bool) -> None:
+
+    # Get the date interval
+    startDate, endDate = (date.toString('yyyy-MM-dd') for date in dates)
+
+    # Skip the range if it was completed before the interruption, else resume it
+    cp = Checkpoint(scraper, genreJson['slug'], startDate if partitioned else '')
+    if cp.done:
+        printline(scraper, 'Genre already scraped. Skipping...')
+        return
+
+    # Run subroutine
+    if partitioned:
+        printline(scraper, 'Parsing releases from', startDate, 'to', endDate + '...')
+    scrapeGenre(scraper, modulegenres, genreJson, startDate, endDate, wm, cp, fetched, cp.page)
+    cp.finish()
 
 
 def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
 
-    # Get the date intervals
-    endDate = QtCore.QDate.currentDate().toString('yyyy-MM-dd')
-    startDate = getLastUse().toString('yyyy-MM-dd')
-
-    # Parse the genre JSON
-    for entry in genredata['results']:
-
-        # If the main genre matches, scrape it
-        if moduledata.genres[entry['name'].lower()]:
-            printline(scraper, 'Parsing genre', entry['name'] + '...')
-            scrapeGenre(scraper, moduledata.genres, entry, startDate, endDate)
-
-        # If at least one subgenre matches, also scrape it
-        else:
-            for subentry in entry['sub_genres']:
-                if moduledata.genres[subentry['name'].lower()]:
-                    printline(scraper, 'Parsing genre', subentry['name'] + '...')
-                    scrapeGenre(scraper, moduledata.genres, entry, startDate, endDate)
-                    break
+    # Get the date intervals (partitioned when backfilling)
+    ranges = getDateRanges()
+    partitioned = len(ranges) > 1
+
+    # Keep track of the releases fetched in this run, as they can be listed under multiple genres
+    fetched = set()
+
+    # Get the main genres containing the enabled genres/subgenres, in index order
+    index = getGenreIndex(scraper)
+    enabled = set()
+    for genre, status in moduledata.genres.items():
+        if status:
+            enabled.update(index['parents'].get(genre, []))
+
+    # Parse each main genre
+    for name, entry in index['genres'].items():
+        if name not in enabled:
+            continue
+        printline(scraper, 'Parsing genre', entry['name'] + '...')
+
+        # Scrape the date intervals concurrently, each one with its own pagination
+        wm = Watermark(scraper, entry['slug'])
+        for _ in parallelMap(scraper, lambda dates: scrapeRange(scraper, moduledata.genres, entry, dates, wm, fetched, partitioned), ranges):
+            pass
+        wm.commit()
+
+
+def scanMain(scanner: PluginScanner, moduledata: Plugin) -> bool:
+
+    # Load the genre index, do not load the plugin if it fails
+    try:
+        index = getGenreIndex(scanner)
+    except Exception as e:
+        printline(scanner, 'Failed to load genre data:', e)
+        return False
+
+    # Add each genre and subgenre (default to enabled)
+    for genre in sorted(index['parents']):
+        moduledata.genres[genre] = True
+    return True
 
 
 if __name__ == '__main__':
@@ -3,10 +3,11 @@
 # modules/hardstylecom.py
 # Hardstyle.com Scraper
 
+from bs4 import SoupStrainer
 from bs4.element import Tag
 from qtpy import QtCore
 
-from common import getWebPage, openURL, printline, verifyDate
+from common import Checkpoint, Watermark, getListingPages, getReleaseDate, getWebPage, isAfterRange, isKnownRelease, openURL, parallelMap, printline, setKnownRelease, setReleaseDate, verifyDate
 from plugin import Plugin
 from scraping import Song, SongScraper
 
@@ -19,6 +20,9 @@ gimmeplugin = {'name': 'Hardstyle.com',
 baseURL = 'https://music.hardstyle.com/%s-releases/page/%d'
 downloadURL = 'https://preview.content.hardstyle.com/index2.php?id=%s'
 
+# Only the middle column of the entry pages contains the relevant data
+detailstrainer = SoupStrainer(id='column-middle')
+
 
 def scrapeSong(scraper: SongScraper, data: Tag) -> None:
 
@@ -54,38 +58,99 @@ def scrapeAlbum(scraper: SongScraper, data: Tag) -> None:
         scrapeSong(scraper, entry)
 
 
-def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
+def getDetails(scraper: SongScraper, url: str) -> Tag:
+
+    # Get the entry page, only parsing the middle column
+    wp = getWebPage(scraper, openURL(scraper, 'get', url), detailstrainer)
+    if not wp:
+        return None
+    return wp.select_one('#column-middle')
+
+
+def getReleasePageDate(scraper: SongScraper, url: str) -> QtCore.QDate:
+
+    # Use the release date stored in a previous run if present, else get it from the entry page
+    date = getReleaseDate(scraper, url)
+    if not date.isValid():
+        data = getDetails(scraper, url)
+        if data:
+            date = parseDate(scraper, url, data)
+    return date
+
+
+def parseDate(scraper: SongScraper, url: str, data: Tag) -> QtCore.QDate:
+
+    # Check release date: div id="column-middle" -> div class="box" -> meta itemprop="releaseDate"
+    date = QtCore.QDate.fromString(data.contents[1].contents[1]['content'], 'dd.MM.yyyy')
+    setReleaseDate(scraper, url, date)
+    return date
+
+
+def getListing(scraper: SongScraper, genre: str, page: int) -> list:
 
     # Get page, exit if not found
     wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genre, page), silent=False, clearcookies=True))
     if not wp:
-        return
+        return None
 
     # Get the entry table:
     # Use a CSS selector to find tbody -> select all "tr"s with a class attribute set
-    table = wp.body.select_one('.p-10.content > .list > tbody').find_all('tr', class_=True, recursive=False)
+    return wp.body.select_one('.p-10.content > .list > tbody').find_all('tr', class_=True, recursive=False)
+
+
+def scrapePage(scraper: SongScraper, table: list, wm: Watermark, cp: Checkpoint) -> bool:
+    urls = []
+    stop = False
     for entry in table:
         printline(scraper, 'Parsing entry...')
 
-        # Unfortunately this website is crappy, so part of the data is hidden inside the entry's page
-        # Checking the Last-Modified attribute won't work because the audio files are uploaded several days before the official release
-        # So, get the web page. If it fails, keep going
-        wp = getWebPage(scraper, openURL(scraper, 'get', entry.td.a['href']))
-        if not wp:
+        # Skip the release if it was processed before the interruption
+        url = entry.td.a['href']
+        if cp.skip(url):
             continue
 
-        # Get the info using a CSS selector
-        data = wp.select_one('#column-middle')
+        # Stop if the release was already scraped in a previous run
+        if wm.reached(url):
+            printline(scraper, 'Reached previously scraped entries. Moving on...')
+            stop = True
+            break
 
-        # Check release date: div id="column-middle" -> div class="box" -> meta itemprop="releaseDate"
-        # If delta date is reached, exit immediately
-        date = QtCore.QDate.fromString(data.contents[1].contents[1]['content'], 'dd.MM.yyyy')
-        ret = verifyDate(date)
-        if not ret:
+        # If the release date was stored in a previous run, check it before getting the page
+        date = getReleaseDate(scraper, url)
+        if date.isValid() and not verifyDate(date):
             printline(scraper, 'Reached max delta date. Moving on...')
-            return
+            stop = True
+            break
+        if date.isValid() and isAfterRange(date):
+            printline(scraper, 'Release is past the backfill end date. Skipping...')
+            continue
+
+        # Skip the release if it was scraped in a previous run, without getting its page
+        if isKnownRelease(scraper, url):
+            printline(scraper, 'Release found in a previous run. Skipping...')
+            wm.update(url)
+            cp.update(url)
+            continue
+        urls.append(url)
+
+    # Unfortunately this website is crappy, so part of the data is hidden inside the entry's page
+    # Checking the Last-Modified attribute won't work because the audio files are uploaded several days before the official release
+    # So, get the web pages concurrently and process them in listing order. If one fails, keep going
+    for url, data in zip(urls, parallelMap(scraper, lambda url: getDetails(scraper, url), urls)):
+        if not data:
+            continue
+
+        # If delta date is reached, exit immediately (cancelling the remaining downloads)
+        date = parseDate(scraper, url, data)
+        if not verifyDate(date):
+            printline(scraper, 'Reached max delta date. Moving on...')
+            return False
+        if isAfterRange(date):
+            printline(scraper, 'Release is past the backfill end date. Skipping...')
+            continue
 
         # Check if it's an album and act accordingly
+        wm.update(url)
         data = data.div
         isAlbum = data['itemtype'].endswith('m')
         if isAlbum:
@@ -93,8 +158,24 @@ def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
         else:
             scrapeSong(scraper, data)
 
-    # Recursively scrape the next page
-    scrapeGenre(scraper, genre, page + 1)
+        # Save the progress
+        setKnownRelease(scraper, url)
+        cp.update(url)
+
+    # Only continue if neither the previously scraped entries nor the delta date were reached
+    return not stop
+
+
+def scrapeGenre(scraper: SongScraper, genre: str, wm: Watermark, cp: Checkpoint, page: int = 1) -> None:
+
+    # Get the pages in range, scraping them in order
+    # Incremental scrapes usually stop within the first pages, so they are fetched one at a time instead of finding the last one
+    getpage = lambda page: getListing(scraper, genre, page)
+    inrange = lambda table: verifyDate(getReleasePageDate(scraper, table[0].td.a['href']))
+    for page, table in getListingPages(scraper, getpage, inrange, page, wm.active):
+        cp.setPage(page)
+        if not table or not scrapePage(scraper, table, wm, cp):
+            return
 
 
 def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
@@ -107,8 +188,17 @@ def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
             # Small fixes for genre names
             genre = genre.replace('hap', 'uk hap').replace(' ', '-')
 
+            # Skip the genre if it was completed before the interruption, else resume it
+            cp = Checkpoint(scraper, genre)
+            if cp.done:
+                printline(scraper, 'Genre already scraped. Skipping...')
+                continue
+
             # Run subroutine
-            scrapeGenre(scraper, genre)
+            wm = Watermark(scraper, genre)
+            scrapeGenre(scraper, genre, wm, cp, cp.page)
+            wm.commit()
+            cp.finish()
 
 
 if __name__ == '__main__':
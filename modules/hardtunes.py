@@ -7,8 +7,9 @@ import re
 
 from bs4.element import Tag, NavigableString
 from qtpy import QtCore
+import requests
 
-from common import getWebPage, openURL, printline, verifyDate
+from common import Checkpoint, Watermark, createSession, getPluginData, getReleaseDate, getWebPage, isAfterRange, isKnownRelease, openURL, parallelMap, printline, setKnownRelease, setPluginData, setReleaseDate, verifyDate
 from plugin import Plugin
 from scraping import Song, SongScraper
 
@@ -23,46 +24,82 @@ downloadURL = 'https://www.hardtunes.com/call/add/playlist'
 playlistURL = 'https://www.hardtunes.com/call/view/playlist'
 
 
-def scrapeSong(scraper: SongScraper, genre: str, id: str, album: str = '') -> None:
+def getTrack(scraper: SongScraper, id: str, session: requests.Session, clearcookies: bool = False) -> dict:
 
-    # Use a POST request to get the rest of the metadata
-    printline(scraper, 'Scraping song...')
-    resp = openURL(scraper, 'post', downloadURL, clearcookies=True, data={'product_id': id})
+    # Track metadata never changes, so use the stored one if available
+    track = getPluginData(scraper, f'track/{id}')
+    if track:
+        return track
+
+    # Else use a POST request to get it
+    resp = openURL(scraper, 'post', downloadURL, clearcookies=clearcookies, session=session, data={'product_id': id})
     if not resp:
-        return
+        return None
 
-    # Build class and emit event
+    # Store it
     resp = resp.json()['player']
     a = resp['title'].split('<br/>')
-    scraper.songfound.emit(Song(a[0], a[1], album, genre.title(), resp['mp3']), 'HardTunes')
+    track = {'name': a[0], 'artist': a[1], 'audiourl': resp['mp3']}
+    setPluginData(scraper, f'track/{id}', track)
+    return track
+
 
+def scrapeSong(scraper: SongScraper, genre: str, id: str, session: requests.Session) -> bool:
+
+    # Get the metadata (the session is only used by this thread, so its playlist can be cleared)
+    printline(scraper, 'Scraping song...')
+    track = getTrack(scraper, id, session, True)
+    if not track:
+        return False
+
+    # Build class and emit event
+    scraper.songfound.emit(Song(track['name'], track['artist'], '', genre.title(), track['audiourl']), 'HardTunes')
+    return True
 
-def scrapeAlbum(scraper: SongScraper, genre: str, album: str, id: str):
 
-    # Use a POST+GET request to get the metadata (will it work?)
+def scrapeAlbum(scraper: SongScraper, genre: str, album: str, id: str) -> bool:
+
+    # Use a POST+GET request to get the metadata
+    # The website keeps the playlist in the session, so use a separate one for each album
     printline(scraper, 'Scraping album...')
-    resp = openURL(scraper, 'post', downloadURL, clearcookies=True, data={'album_id': id})
-    if not resp:
-        return
-    resp = getWebPage(scraper, openURL(scraper, 'get', playlistURL))
-    if not resp:
-        return
+    with createSession() as session:
+        resp = openURL(scraper, 'post', downloadURL, session=session, data={'album_id': id})
+        if not resp:
+            return False
+        resp = getWebPage(scraper, openURL(scraper, 'get', playlistURL, session=session))
+        if not resp:
+            return False
+
+        ids = []
+        for entry in resp.body.div.children:
+
+            # This website returns broken HTML which yields children consisting of a single newline. Ignore them
+            if type(entry) == NavigableString:
+                continue
 
-    for entry in resp.body.div.children:
+            # Parse the id (with more broken HTML bullshit)
+            entry = entry.find('div', class_='release-list-item-info-primary')
+            ids.append(entry.p.a['href'].split('/')[-1])
 
-        # This website returns broken HTML which yields children consisting of a single newline. Ignore them
-        if type(entry) == NavigableString:
-            continue
+    # Get the tracks concurrently and emit them in order, reporting success only if all of them were found
+    # Each track is requested from its own session, as the album's one holds the album playlist and the player
+    # response must match the requested track
+    def getAlbumTrack(id: str) -> dict:
+        with createSession() as tracksession:
+            return getTrack(scraper, id, tracksession, True)
 
-        # Parse the id and call scrapeSong (with more broken HTML bullshit)
-        entry = entry.find('div', class_='release-list-item-info-primary')
-        id = entry.p.a['href'].split('/')[-1]
-        scrapeSong(scraper, genre, id, album)
+    found = 0
+    for track in parallelMap(scraper, getAlbumTrack, ids):
+        if track:
+            scraper.songfound.emit(Song(track['name'], track['artist'], album, genre.title(), track['audiourl']), 'HardTunes')
+            found += 1
+    return found == len(ids)
 
 
-def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
+def scrapeGenre(scraper: SongScraper, genre: str, wm: Watermark, cp: Checkpoint, session: requests.Session, page: int = 1) -> None:
 
     # Get page, exit if not found
+    cp.setPage(page)
     wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genre, page), silent=False))
     if not wp:
         return
@@ -84,9 +121,18 @@ def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
             continue
         isAlbum = type != 'Single tune'
 
+        # Skip the release if it was processed before the interruption
+        if cp.skip(url):
+            continue
+
+        # Stop if the release was already scraped in a previous run
+        if wm.reached(url):
+            printline(scraper, 'Reached previously scraped entries. Moving on...')
+            return
+
         # If date is today, assume it is allowed
         if datestr == 'Today':
-            pass
+            date = QtCore.QDate.currentDate()
 
         # If date is yesterday, do a rudimentary check
         elif datestr == 'Yesterday':
@@ -97,13 +143,17 @@ def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
 
         # For other dates of the week, we unfortunately have to open the page
         # Checking the Last-Modified attribute won't work because the files are uploaded several days before the official release
-        # So, get the web page. If it fails, keep going
+        # So, get the web page (unless the date was stored in a previous run). If it fails, keep going
         elif datestr == 'This week':
-            subpage = openURL(scraper, 'get', url)
-            if not subpage:
-                continue
+            date = getReleaseDate(scraper, url)
+            if not date.isValid():
+                subpage = openURL(scraper, 'get', url)
+                if not subpage:
+                    continue
+
+                date = QtCore.QDate.fromString(re.search(r'\d{4}-\d{2}-\d{2}', subpage.text).group(), 'yyyy-MM-dd')
+                setReleaseDate(scraper, url, date)
 
-            date = QtCore.QDate.fromString(re.search(r'\d{4}-\d{2}-\d{2}', subpage.text).group(), 'yyyy-MM-dd')
             if not verifyDate(date):
                 printline(scraper, 'Reached max delta date. Moving on...')
                 return
@@ -113,28 +163,62 @@ def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
             printline(scraper, 'Reached max delta date. Moving on...')
             return
 
-        # Act accordingly
+        # Skip the release if it's past the backfill end date
+        if isAfterRange(date):
+            printline(scraper, 'Release is past the backfill end date. Skipping...')
+            continue
+
+        # Skip the release if it was scraped in a previous run
+        if isKnownRelease(scraper, url):
+            printline(scraper, 'Release found in a previous run. Skipping...')
+            wm.update(url)
+            cp.update(url)
+            continue
+
+        # Act accordingly, and keep going if it fails
         if isAlbum:
-            scrapeAlbum(scraper, genre, entry.contents[1].div.p.a.string, url.split('/')[-1])
+            success = scrapeAlbum(scraper, genre, entry.contents[1].div.p.a.string, url.split('/')[-1])
         else:
-            scrapeSong(scraper, genre, url.split('/')[-1])
+            success = scrapeSong(scraper, genre, url.split('/')[-1], session)
+        if not success:
+            printline(scraper, 'Failed to scrape the release. Skipping...')
+            continue
+
+        # Save the progress (only now that the release was processed)
+        wm.update(url)
+        setKnownRelease(scraper, url)
+        cp.update(url)
 
     # Call this again for the next page
-    scrapeGenre(scraper, genre, page + 1)
+    scrapeGenre(scraper, genre, wm, cp, session, page + 1)
 
 
-def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
+def processGenre(scraper: SongScraper, genre: str) -> None:
+    printline(scraper, 'Parsing genre', genre.title() + '...')
+
+    # Small fixes for genre names
+    genre = genre.replace(' ', '-')
 
-    # Parse each genre if enabled
-    for genre, enabled in moduledata.genres.items():
-        if enabled:
-            printline(scraper, 'Parsing genre', genre.title() + '...')
+    # Skip the genre if it was completed before the interruption, else resume it
+    cp = Checkpoint(scraper, genre)
+    if cp.done:
+        printline(scraper, 'Genre already scraped. Skipping...')
+        return
+
+    # Run subroutine, with a separate session for the single tunes
+    wm = Watermark(scraper, genre)
+    with createSession() as session:
+        scrapeGenre(scraper, genre, wm, cp, session, cp.page)
+    wm.commit()
+    cp.finish()
 
-            # Small fixes for genre names
-            genre = genre.replace(' ', '-')
 
-            # Run subroutine
-            scrapeGenre(scraper, genre)
+def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
+
+    # Parse the enabled genres concurrently
+    genres = [genre for genre, enabled in moduledata.genres.items() if enabled]
+    for _ in parallelMap(scraper, lambda genre: processGenre(scraper, genre), genres):
+        pass
 
 
 if __name__ == '__main__':
@@ -3,10 +3,13 @@
 # modules/junodownload.py
 # JunoDownload Scraper
 
-from bs4 import Tag
+import re
+
+from bs4 import SoupStrainer, Tag
+import soupsieve
 from qtpy import QtCore
 
-from common import getWebPage, openURL, printline, verifyDate
+from common import Checkpoint, Watermark, getListingPages, getWebPage, isAfterRange, openURL, printline, verifyDate
 from plugin import Plugin
 from scraping import Song, SongScraper
 
@@ -66,73 +69,99 @@ gimmeplugin = {'name': 'JunoDownload',
                  'version': '1.0',
                  'description': 'Dance MP3 download store with over 2 million tracks available and thousands more added each week.'}
 
-datemap = {
-    'Jan': '1',
-    'Feb': '2',
-    'Mar': '3',
-    'Apr': '4',
-    'May': '5',
-    'Jun': '6',
-    'Jul': '7',
-    'Aug': '8',
-    'Sep': '9',
-    'Oct': '10',
-    'Nov': '11',
-    'Dec': '12'
-}
+# Month abbreviations, for date parsing
+# Qt insists on using the user's locale for month names instead of English, and converts 22 to 1922 instead of 2022
+months = {month: i for i, month in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+datere = re.compile(r'(\d+) (\w+) (\d+)')
+
+# Only parse the listing entries, then use precompiled selectors to get their data
+listingstrainer = SoupStrainer('div', class_='row gutters-sm jd-listing-item')
+titleselector = soupsieve.compile('a.juno-title')
+artistselector = soupsieve.compile('div.col.juno-artist')
+tracklistselector = soupsieve.compile('div.jd-listing-tracklist')
+
+# Characters to clean from the track names
+nametable = str.maketrans({'\xa0': ' ', '"': None})
 
 baseURL='https://www.junodownload.com/%s/back-cat/releases/%d/?order=date_down'
 
 
-def scrapeGenre(scraper: SongScraper, genre: str, page: int = 1) -> None:
+def parseDate(entry: Tag) -> QtCore.QDate:
+
+    # Convert the entry's "dd Mon yy" date directly
+    match = datere.search(entry.contents[2].div.contents[2])
+    if not match or match.group(2) not in months:
+        return QtCore.QDate()
+    return QtCore.QDate(2000 + int(match.group(3)), months[match.group(2)], int(match.group(1)))
+
+
+def getListing(scraper: SongScraper, genre: str, page: int) -> list:
 
     # Unfortunately, while the API is still functional, it hasn't been possible to register an API key for years
     # Therefore, fall back to good old HTML scraping
-    wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genre, page)))
+    wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genre, page)), listingstrainer)
     if not wp:
-        return
-
-    # Use a CSS selector to get the table, then select all child divs with class "row gutters-sm jd-listing-item"
-    table = wp.select_one('.order-lg-2.order-1.col-lg-9.col-12')
-    table = table.find_all('div', class_='row gutters-sm jd-listing-item', recursive=False)
-
-    # Parse the table
-    for entry in table:
-        printline(scraper, 'Parsing entry...')
-
-        # Date check
-        # First, we need to do some magic with date formatting
-        # This is because Qt insists on using the user's locale for formatting instead of English
-        # And also because 22 is converted to 1922, not 2022
-        date = entry.contents[2].div.contents[2].split()
-        date[1] = datemap[date[1]]
-        date[2] = '20' + date[2]
-        date = QtCore.QDate.fromString(' '.join(date), 'dd M yyyy')
-        if not verifyDate(date):
-            printline(scraper, 'Reached max delta date. Moving on...')
-            return
+        return None
+    return wp.find_all('div', class_='row gutters-sm jd-listing-item', recursive=False)
 
-        # Artist + hotfix for Various Artists
-        artist = entry.find('div', class_='col juno-artist').contents[0]
-        if type(artist) == Tag:
-            artist = artist.contents[0]
 
-        # Rest of the data
-        album = entry.find('a', class_='juno-title').contents[0]
-        songs = entry.find('div', class_='jd-listing-tracklist').contents
-        for song in songs:
+def scrapeGenre(scraper: SongScraper, genre: str, wm: Watermark, cp: Checkpoint, page: int = 1) -> None:
 
-            # Can't even get the name easily due to shitty formatting
-            name = song.contents[1].contents[0].replace('\xa0', ' ').replace('"', '').split(' - ')
-            i = len(name)
-            audiourl = song.div.button['data-href']
-            if i < 3:
-                scraper.songfound.emit(Song(name[0], artist, album, genre.title(), audiourl), 'JunoDownload')
-            else:
-                scraper.songfound.emit(Song(name[1], name[0], album, genre.title(), audiourl), 'JunoDownload')
+    # Get the pages in range, parsing them in order
+    # Incremental scrapes usually stop within the first pages, so they are fetched one at a time instead of finding the last one
+    getpage = lambda page: getListing(scraper, genre, page)
+    inrange = lambda table: verifyDate(parseDate(table[0]))
+    for page, table in getListingPages(scraper, getpage, inrange, page, wm.active):
+        cp.setPage(page)
 
-    # Call this again for the next page
-    scrapeGenre(scraper, genre, page + 1)
+        # Stop if the page failed or has no entries
+        if not table:
+            return
+
+        # Parse the table
+        for entry in table:
+            printline(scraper, 'Parsing entry...')
+
+            # Date check
+            date = parseDate(entry)
+            if not verifyDate(date):
+                printline(scraper, 'Reached max delta date. Moving on...')
+                return
+            if isAfterRange(date):
+                printline(scraper, 'Release is past the backfill end date. Skipping...')
+                continue
+
+            # Skip the release if it was processed before the interruption
+            title = titleselector.select_one(entry)
+            if cp.skip(title['href']):
+                continue
+
+            # Stop if the release was already scraped in a previous run
+            if wm.reached(title['href']):
+                printline(scraper, 'Reached previously scraped entries. Moving on...')
+                return
+            wm.update(title['href'])
+
+            # Artist + hotfix for Various Artists
+            artist = artistselector.select_one(entry).contents[0]
+            if type(artist) == Tag:
+                artist = artist.contents[0]
+
+            # Rest of the data
+            album = title.contents[0]
+            songs = tracklistselector.select_one(entry).contents
+            for song in songs:
+
+                # Can't even get the name easily due to shitty formatting
+                name = song.contents[1].contents[0].translate(nametable).split(' - ')
+                audiourl = song.div.button['data-href']
+                if len(name) < 3:
+                    scraper.songfound.emit(Song(name[0], artist, album, genre.title(), audiourl), 'JunoDownload')
+                else:
+                    scraper.songfound.emit(Song(name[1], name[0], album, genre.title(), audiourl), 'JunoDownload')
+
+            # Save the progress
+            cp.update(title['href'])
 
 
 def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
@@ -145,8 +174,17 @@ def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
             # Get genre from the map
             genre = genremap[genre]
 
+            # Skip the genre if it was completed before the interruption, else resume it
+            cp = Checkpoint(scraper, genre)
+            if cp.done:
+                printline(scraper, 'Genre already scraped. Skipping...')
+                continue
+
             # Run subroutine
-            scrapeGenre(scraper, genre)
+            wm = Watermark(scraper, genre)
+            scrapeGenre(scraper, genre, wm, cp, cp.page)
+            wm.commit()
+            cp.finish()
 
 
 if __name__ == '__main__':
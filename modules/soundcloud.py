@@ -5,66 +5,169 @@
 
 import os
 import re
+import threading
 from qtpy import QtCore
 from qtpy.QtCore import Qt
+from requests import Response
 
-from common import getAbsPath, openURL, printline, verifyDate
+from common import Checkpoint, Watermark, getAbsPath, getPluginData, isAfterRange, openURL, parallelMap, printline, setPluginData, verifyDate
 from plugin import Plugin, PluginScanner
 from scraping import Song, SongScraper
 
 # Metadata
 gimmeplugin = {'name': 'SoundCloud',
+                 'files': ['soundcloudusers.txt'],
                  'author': 'CLF78',
                  'version': '2.0',
-                 'description': 'Stream and listen to music online for free.\n<i>NOTE: Add users you want to check to the file "soundcloudusers.txt" in the "modules" folder.</i>'}
+                 'description': 'Stream and listen to music online for free.\n<i>NOTE: Add users you want to check to the file "soundcloudusers.txt" in the "modules" folder.</i>',
+                 'pagelinks': True}
 
 # Core URLs
 homeurl='https://soundcloud.com'
 apiurl='https://api-v2.soundcloud.com'
 userlistpath = getAbsPath('soundcloudusers.txt')
 
-# Individual user scraping function
-def scrapeUser(scraper: SongScraper, userid: str, client_id: str, offset: str = '0') -> None:
+# Number of tracks requested per page (the maximum allowed by the API)
+pagesize = 200
 
-    # Get the latest 20 entries
-    params = {'client_id': client_id, 'limit': 20, 'offset': offset}
-    usertracks = openURL(scraper, 'get', f'{apiurl}/users/{userid}/tracks', params=params)
-    if not usertracks:
-        return
+# Client ID used for API calls (stored across runs and only requested again if rejected)
+clientID = ''
+clientIDLock = threading.Lock()
 
-    # Get the tracks
-    usertracks = usertracks.json()['collection']
-    printline(scraper, 'Processing', len(usertracks), 'tracks...')
-    for track in usertracks:
 
-        # Verify timestamp
-        date = QtCore.QDate.fromString(track['created_at'], Qt.ISODate)
-        if not verifyDate(date):
-            printline(scraper, 'Reached max delta date. Moving on...')
-            return
+# Client ID discovery function
+def findClientID(scraper: SongScraper) -> str:
+
+    # To make API calls, we need a client ID. Therefore, download the main page
+    printline(scraper, 'Requesting Client ID...')
+    homePage = openURL(scraper, 'get', homeurl, clearcookies=True)
+    if not homePage:
+        return ''
+
+    # The ID is hidden in one of the linked JS files. Code copied and modified from youtube-dl
+    # The list is parsed in reverse as the relevant files are usually at the bottom of the HTML
+    # The files are downloaded in parallel, stopping at the first match
+    srcs = list(reversed(re.findall(r'<script[^>]+src="([^"]+)"', homePage.text)))
+    for script in parallelMap(scraper, lambda src: openURL(scraper, 'get', src), srcs):
+        if script:
+
+            # Find the first match and sanitize it
+            matches = re.search(r'client_id\s*:\s*"([0-9a-zA-Z]{32})"', script.text)
+            if matches:
+                printline(scraper, 'Found Client ID:', matches.group(1))
+                setPluginData(scraper, 'client_id', matches.group(1))
+                return matches.group(1)
+
+    return ''
+
+
+# API request function
+def apiRequest(scraper: SongScraper, path: str, params: dict) -> Response:
+    global clientID
+
+    # Paths can also be full URLs (such as the cursors returned by the API)
+    url = path if path.startswith('http') else f'{apiurl}/{path}'
+
+    # If the client ID is rejected, request a new one (only once across threads) and retry
+    for _ in range(2):
+        currentID = clientID
+        resp = openURL(scraper, 'get', url, params=params | {'client_id': currentID}, acceptstatus=(401, 403))
+        if resp is None or resp.status_code not in (401, 403):
+            return resp
+
+        printline(scraper, 'Client ID rejected!')
+        with clientIDLock:
+            if clientID == currentID:
+                clientID = findClientID(scraper)
+        if not clientID:
+            break
 
-        # Skip tracks longer than 15 minutes
-        if track['duration'] > 900000:
-            continue
+    return None
 
-        # Find the direct download link. If found, append the track to the list
-        scraper.songfound.emit(Song(name=track['title'], artist=track['user']['username'], genre=track['genre'], audiourl=track['permalink_url']), 'SoundCloud')
 
-    # If we reach the end of the loop, call this function again with a different offset
-    lastdate = track['created_at']
-    scrapeUser(scraper, userid, client_id, lastdate)
+# Individual user scraping function
+def scrapeUser(scraper: SongScraper, userid: str, wm: Watermark, cp: Checkpoint, cursor: object = None) -> None:
+
+    # Start from the latest entries, unless resuming from a saved cursor
+    if not isinstance(cursor, str):
+        cursor = f'{apiurl}/users/{userid}/tracks?limit={pagesize}&linked_partitioning=1'
+
+    # Follow the cursors returned by the API until the end of the list
+    while cursor and not scraper.terminate:
+        cp.setPage(cursor)
+        usertracks = apiRequest(scraper, cursor, {})
+        if not usertracks:
+            return
+
+        # Get the tracks
+        usertracks = usertracks.json()
+        printline(scraper, 'Processing', len(usertracks['collection']), 'tracks...')
+        for track in usertracks['collection']:
+
+            # Verify timestamp
+            date = QtCore.QDate.fromString(track['created_at'], Qt.ISODate)
+            if not verifyDate(date):
+                printline(scraper, 'Reached max delta date. Moving on...')
+                return
+            if isAfterRange(date):
+                printline(scraper, 'Track is past the backfill end date. Skipping...')
+                continue
+
+            # Skip the track if it was processed before the interruption
+            trackid = str(track['id'])
+            if cp.skip(trackid):
+                continue
+
+            # Stop if the track was already scraped in a previous run
+            if wm.reached(trackid):
+                printline(scraper, 'Reached previously scraped tracks. Moving on...')
+                return
+            wm.update(trackid)
+
+            # Skip tracks longer than 15 minutes
+            if track['duration'] > 900000:
+                continue
+
+            # Find the direct download link. If found, append the track to the list
+            scraper.songfound.emit(Song(name=track['title'], artist=track['user']['username'], genre=track['genre'], audiourl=track['permalink_url']), 'SoundCloud')
+            cp.update(trackid)
+
+        # Move to the next page
+        cursor = usertracks.get('next_href')
+
+
+# User processing function
+def processUser(scraper: SongScraper, user: str) -> None:
+    printline(scraper, 'Processing user', user + '...')
+
+    # Skip the user if it was completed before the interruption, else resume it
+    cp = Checkpoint(scraper, user)
+    if cp.done:
+        printline(scraper, 'User already scraped. Skipping...')
+        return
+
+    userid = findUserID(scraper, user)
+    if userid:
+        wm = Watermark(scraper, user)
+        scrapeUser(scraper, userid, wm, cp, cp.page)
+        wm.commit()
+        cp.finish()
+    else:
+        printline(scraper, 'Invalid user list entry', user)
 
 
 # Locate user ID
-def findUserID(scraper: SongScraper, username: str, client_id: str) -> str:
+def findUserID(scraper: SongScraper, username: str) -> str:
 
-    # Initialize to empty string
-    userid = ''
+    # User IDs never change, so use the stored one if available
+    userid = getPluginData(scraper, f'user/{username}', '')
+    if userid:
+        return userid
 
     # Get the user id by executing a search query for the username
     # Not my proudest solution, but it does the job without requiring an API key (which SC doesn't even provide)
-    params = {'q': username, 'client_id': client_id, 'limit': 20}
-    searchresults = openURL(scraper, 'get', f'{apiurl}/search/users', params=params)
+    params = {'q': username, 'limit': 20}
+    searchresults = apiRequest(scraper, 'search/users', params)
     if searchresults:
 
         # Make sure the result matches the username given
@@ -75,9 +178,10 @@ def findUserID(scraper: SongScraper, username: str, client_id: str) -> str:
                     userid = entry['urn'].split(':')[2]
                     break
 
-    # Return the ID
+    # Store and return the ID
     if userid:
         printline(scraper, 'Found userid:', userid)
+        setPluginData(scraper, f'user/{username}', userid)
     else:
         printline(scraper, 'Username', username, 'not found!')
     return userid
@@ -86,41 +190,19 @@ def findUserID(scraper: SongScraper, username: str, client_id: str) -> str:
 # Main scraping function
 def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
 
-    # Initialize variables
-    client_id = ''
-
-    # To make API calls, we need a client ID. Therefore, download the main page
-    printline(scraper, 'Requesting Client ID...')
-    homePage = openURL(scraper, 'get', homeurl, clearcookies=True)
-    if homePage:
-
-        # The ID is hidden in one of the linked JS files. Code copied and modified from youtube-dl
-        # The list is parsed in reverse as the relevant files are usually at the bottom of the HTML
-        for src in reversed(re.findall(r'<script[^>]+src="([^"]+)"', homePage.text)):
-            script = openURL(scraper, 'get', src)
-            if script:
-
-                # Find the first match and sanitize it
-                matches = re.search(r'client_id\s*:\s*"([0-9a-zA-Z]{32})"', script.text)
-                if matches:
-                    client_id = matches.group()[11:-1]
-                    printline(scraper, 'Found Client ID:', client_id)
-                    break
+    # Use the stored client ID, or request one if missing
+    global clientID
+    clientID = getPluginData(scraper, 'client_id', '') or findClientID(scraper)
 
     # If the client id was not found, return immediately
-    if not client_id:
+    if not clientID:
         printline(scraper, 'Could not find Client ID! Bailing...')
         return
 
-    # Parse each user
-    for user, enabled in moduledata.genres.items():
-        if enabled:
-            printline(scraper, 'Processing user', user + '...')
-            userid = findUserID(scraper, user, client_id)
-            if userid:
-                scrapeUser(scraper, userid, client_id)
-            else:
-                printline(scraper, 'Invalid user list entry', user)
+    # Parse the users concurrently
+    users = [user for user, enabled in moduledata.genres.items() if enabled]
+    for _ in parallelMap(scraper, lambda user: processUser(scraper, user), users):
+        pass
 
 
 def scanMain(scanner: PluginScanner, moduledata: Plugin):
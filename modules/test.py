@@ -13,11 +13,15 @@ from scraping import Song, SongScraper
 # author = plugin author (string, optional)
 # version = plugin version (string, optional)
 # description = a brief description (string, optional)
+# files = data files read by the scan function, relative to the modules folder (list, optional)
+# pagelinks = whether the audio URLs lead to web pages instead of audio files, so they are only checked for errors (bool, optional)
+# The metadata is stored after the first scan, and the plugin is only imported again if its file or data files change
 gimmeplugin = {'name': 'Test Plugin',
                  'genres': ['house', 'techno'],
                  'author': 'CLF78',
                  'version': 'TEST',
-                 'description': 'Test plugin.'}
+                 'description': 'Test plugin.',
+                 'pagelinks': True}
 
 # Main scraping function
 # This will be called by the scraper thread if the plugin is enabled
@@ -35,7 +39,7 @@ def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
 # Main scan function (optional)
 # This is run when the plugin is detected and imported
 # The arguments are:
-# - The PluginScanner instance, required for printing to the console
+# - The PluginScanner instance, required for printing to the console and accessing the plugin data
 # - The module instance, containing the settings indicated by the user
 # Return True if the plugin should be added, else return False
 def scanMain(scanner: PluginScanner, moduledata: Plugin) -> bool:
@@ -6,7 +6,7 @@
 from bs4.element import Tag
 from qtpy import QtCore
 
-from common import getWebPage, openURL, printline, verifyDate
+from common import Checkpoint, Watermark, getListingPages, getReleaseDate, getWebPage, isAfterRange, isBlacklisted, isKnownRelease, openURL, parallelMap, printline, setKnownRelease, setReleaseDate, verifyDate
 from plugin import Plugin
 from scraping import Song, SongScraper
 
@@ -41,16 +41,46 @@ def scrapeAlbum(scraper: SongScraper, page: Tag, album: str, genre: str) -> None
         scraper.songfound.emit(Song(name, artists, album, genre, audiourl), 'UndergroundTekno')
 
 
-def scrapeGenre(scraper: SongScraper, genre: str, category: str, page: int = 1) -> None:
+def getProductPage(scraper: SongScraper, url: str, category: str) -> tuple:
+
+    # Use the release date stored in a previous run if present
+    # Album pages are still needed for the track list, unless the date is out of range
+    date = getReleaseDate(scraper, url)
+    prodpg = None
+    if not date.isValid() or (category == 'albums' and verifyDate(date) and not isAfterRange(date)):
+
+        # Get the webpage to check the date
+        prodpg = getWebPage(scraper, openURL(scraper, 'get', url))
+        if not prodpg:
+            return None
+
+        # Get the date, skipping the entry if the page doesn't have one (such as an error page)
+        try:
+            datestr = prodpg.body.select_one('h5').string.replace('Sortie le ', '').lower()
+        except AttributeError:
+            printline(scraper, 'Failed to parse the release date of', url + '!')
+            return None
+        date = locale.toDate(datestr, 'dd dddd MMMM yyyy')
+        setReleaseDate(scraper, url, date)
+
+    return date, prodpg
+
+
+def getListing(scraper: SongScraper, genre: str, category: str, page: int) -> list:
 
     # Get page, exit if not found
     wp = getWebPage(scraper, openURL(scraper, 'get', baseURL % (genre, category, page), silent=False, clearcookies=True))
     if not wp:
-        return
+        return None
 
     # Get the entry table:
     # Use a CSS selector to find the category div -> select each relevant entry
-    table = wp.body.select_one(f'#tab-tracks').select('div.col-lg-2.col-md-3.col-sm-6.col-xs-12')
+    return wp.body.select_one(f'#tab-tracks').select('div.col-lg-2.col-md-3.col-sm-6.col-xs-12')
+
+
+def scrapePage(scraper: SongScraper, table: list, category: str, wm: Watermark, cp: Checkpoint) -> bool:
+    entries = []
+    reached = False
     for entry in table:
 
         # Get inner div
@@ -62,39 +92,98 @@ def scrapeGenre(scraper: SongScraper, genre: str, category: str, page: int = 1)
             printline(scraper, 'Skipping pre-order entry...')
             continue
 
-        # Get the webpage to check the date
-        prodpg = getWebPage(scraper, openURL(scraper, 'get', entry.div.a['href']))
-        if not prodpg:
-            return
+        # Skip the release if it was processed before the interruption
+        url = entry.div.a['href']
+        if cp.skip(url):
+            continue
 
-        # Get the date
-        datestr = prodpg.body.select_one('h5').string.replace('Sortie le ', '').lower()
-        date = locale.toDate(datestr, 'dd dddd MMMM yyyy')
+        # Stop if the release was already scraped in a previous run
+        if wm.reached(url):
+            printline(scraper, 'Reached previously scraped entries. Moving on...')
+            reached = True
+            break
+
+        # Skip blacklisted artists and releases scraped in a previous run, without getting their page
+        # Albums are only skipped if all of their artists are blacklisted, as the other artists' tracks are still wanted
+        artists = [artist.string for artist in entry.find('div', class_='product-artists').find_all('a')]
+        if artists and (all(map(isBlacklisted, artists)) if category == 'albums' else isBlacklisted(', '.join(artists))):
+            printline(scraper, 'Artist', ', '.join(artists), 'is blacklisted. Skipping...')
+            continue
+        if isKnownRelease(scraper, url):
+            printline(scraper, 'Release found in a previous run. Skipping...')
+            wm.update(url)
+            cp.update(url)
+            continue
+        entries.append((url, entry))
+
+    # Get the product pages concurrently, checking the dates in listing order
+    for (url, entry), result in zip(entries, parallelMap(scraper, lambda item: getProductPage(scraper, item[0], category), entries)):
+        if not result:
+            printline(scraper, 'Failed to get the product page. Skipping...')
+            continue
+
+        date, prodpg = result
         if not verifyDate(date):
             printline(scraper, 'Reached max delta date. Moving on...')
-            return
+            return False
+        if isAfterRange(date):
+            printline(scraper, 'Release is past the backfill end date. Skipping...')
+            continue
 
         # Act depending on the scraped content
+        wm.update(url)
         if category == 'albums':
             entry = entry.find('div', class_='product-inner')
             scrapeAlbum(scraper, prodpg, entry.h2.a.string, entry.div.span.string)
         else:
             scrapeSong(scraper, entry)
 
-    # Recursively scrape the next page
-    scrapeGenre(scraper, genre, category, page + 1)
+        # Save the progress
+        setKnownRelease(scraper, url)
+        cp.update(url)
 
+    # Only continue if the previously scraped entries weren't reached
+    return not reached
 
-def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
 
-    # Parse each genre if enabled
-    for genre, enabled in moduledata.genres.items():
-        if enabled:
-            printline(scraper, 'Parsing genre', genre + '...')
+def scrapeGenre(scraper: SongScraper, genre: str, category: str, wm: Watermark, cp: Checkpoint, page: int = 1) -> None:
+
+    # Check the date of a listing's first entry through its product page
+    def inrange(table: list) -> bool:
+        result = getProductPage(scraper, table[0].div.div.a['href'], 'tracks')
+        return bool(result) and verifyDate(result[0])
+
+    # Get the pages in range, scraping them in order
+    # Incremental scrapes usually stop within the first pages, so they are fetched one at a time instead of finding the last one
+    getpage = lambda page: getListing(scraper, genre, category, page)
+    for page, table in getListingPages(scraper, getpage, inrange, page, wm.active):
+        cp.setPage(page)
+        if not table or not scrapePage(scraper, table, category, wm, cp):
+            return
+
+
+def processCategory(scraper: SongScraper, genre: str, category: str) -> None:
+    printline(scraper, 'Parsing genre', genre, 'category', category + '...')
+
+    # Skip the category if it was completed before the interruption, else resume it
+    cp = Checkpoint(scraper, genre, category)
+    if cp.done:
+        printline(scraper, 'Category', category, 'already scraped. Skipping...')
+        return
+
+    # Run subroutine
+    wm = Watermark(scraper, genre, category)
+    scrapeGenre(scraper, genre, category, wm, cp, cp.page)
+    wm.commit()
+    cp.finish()
+
+
+def scrapeMain(scraper: SongScraper, moduledata: Plugin) -> None:
 
-            # Run subroutine
-            for category in ['tracks', 'albums']:
-                scrapeGenre(scraper, genre, category)
+    # Parse each category of the enabled genres concurrently
+    categories = [(genre, category) for genre, enabled in moduledata.genres.items() if enabled for category in ['tracks', 'albums']]
+    for _ in parallelMap(scraper, lambda item: processCategory(scraper, *item), categories):
+        pass
 
 
 if __name__ == '__main__':
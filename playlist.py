@@ -3,13 +3,19 @@
 # playlist.py
 # This file defines GimmeMusic's playlist widget.
 
+import copy
 import webbrowser
 
-from qtpy import QtCore, QtWidgets
+from qtpy import QtCore, QtGui, QtWidgets
 from qtpy.QtCore import Qt
 
-from common import getMainWindow, printline
+import globalz
+from audiocache import AudioPrefetcher, getCachedAudio
+from common import getMainWindow, isBlacklisted, printline
+from exporter import LiveExporter, PlaylistExporter, getFileFilter
 from scraping import Song
+from session import readSession, writeSession
+from validator import LinkValidator
 
 class EditorDelegate(QtWidgets.QItemDelegate):
     """
@@ -94,18 +100,37 @@ class Playlist(QtWidgets.QWidget):
         L.addWidget(self.removeSelected, 3, 0)
         L.addWidget(self.clearButton, 3, 1)
 
+        # Songs waiting to be saved to the library
+        self.pending = []
+
+        # Background task thread and worker, live exporter
+        self.taskthread = None
+        self.taskworker = None
+        self.liveexporter = None
+        self.linkitems = {}
+
+        # Checkpoint of the running scrape
+        self.checkpoint = None
+
+    def createItem(self, song: Song, modname: str) -> QtWidgets.QTreeWidgetItem:
+        """
+        Creates a playlist item for the given song.
+        """
+        newitem = QtWidgets.QTreeWidgetItem(['', song.name, song.artist, song.album, song.genre, modname])
+        newitem.setCheckState(0, Qt.Unchecked)
+        newitem.setData(0, Qt.UserRole, song)
+        newitem.setFlags((newitem.flags() | Qt.ItemIsEditable) ^ Qt.ItemIsDropEnabled)
+        return newitem
+
     def addEntry(self, song: Song, modname: str):
         """
         Adds an entry to the playlist.
         """
 
         # First, check if the artist is blacklisted
-        blacklist = getMainWindow(self).config.value('Blacklist/blacklist', '')
-        blacklist = blacklist.split(',') if blacklist else []
-        for artist in blacklist:
-            if artist in song.artist:
-                printline(self, 'Artist', song.artist, 'is blacklisted. Skipping...')
-                return
+        if isBlacklisted(song.artist):
+            printline(self, 'Artist', song.artist, 'is blacklisted. Skipping...')
+            return
 
         # Then, check for duplicates
         for i in range(self.tree.topLevelItemCount()):
@@ -114,13 +139,108 @@ class Playlist(QtWidgets.QWidget):
                 printline(self, 'Duplicate entry for', f'{song.name}. Skipping...')
                 return
 
+        # Then, check if it was found in a previous run
+        if globalz.skipknown and globalz.library.isKnown(song):
+            printline(self, 'Song', song.name, 'was found in a previous run. Skipping...')
+            return
+
         # All checks passed, add it!
-        newitem = QtWidgets.QTreeWidgetItem(self.tree, ['', song.name, song.artist, song.album, song.genre, modname])
-        newitem.setCheckState(0, Qt.Unchecked)
-        newitem.setData(0, Qt.UserRole, song)
-        newitem.setFlags((newitem.flags() | Qt.ItemIsEditable) ^ Qt.ItemIsDropEnabled)
+        self.tree.addTopLevelItem(self.createItem(song, modname))
         self.updateButtons()
 
+        # Append it to the live export file
+        if self.liveexporter:
+            self.liveexporter.add(song, modname)
+
+        # Record it to the scrape's checkpoint
+        if self.checkpoint:
+            self.checkpoint.addSong(song, modname)
+
+        # Queue it for the library, saving the queue in bulk
+        self.pending.append((song, modname))
+        if len(self.pending) >= globalz.librarybatch:
+            self.saveToLibrary()
+
+    def loadEntries(self, entries: list):
+        """
+        Adds a list of (song, source) tuples to the playlist in bulk, skipping duplicates.
+        """
+        existing = set()
+        for i in range(self.tree.topLevelItemCount()):
+            item = self.tree.topLevelItem(i)
+            existing.add((item.text(1), item.text(2)))
+
+        items = []
+        for song, modname in entries:
+            if (song.name, song.artist) not in existing:
+                existing.add((song.name, song.artist))
+                items.append(self.createItem(song, modname))
+
+        self.tree.addTopLevelItems(items)
+        self.updateButtons()
+        printline(self, 'Loaded', len(items), 'songs.')
+
+    def restoreEntries(self, entries: list):
+        """
+        Adds the songs of an interrupted scrape to the playlist, queueing them for the library in case they weren't saved.
+        """
+        self.loadEntries(entries)
+        self.pending.extend(entries)
+
+    def saveSession(self, file: str):
+        """
+        Saves the playlist (including order, edits and check states) to a session file.
+        """
+        rows = []
+        for i in range(self.tree.topLevelItemCount()):
+            item = self.tree.topLevelItem(i)
+            rows.append((item.data(0, Qt.UserRole), item.text(5), item.checkState(0) == Qt.Checked))
+        writeSession(file, rows)
+
+    def loadSession(self, file: str):
+        """
+        Replaces the playlist with the contents of a session file.
+        """
+        items = []
+        for song, modname, checked in readSession(file):
+            newitem = self.createItem(song, modname)
+            if checked:
+                newitem.setCheckState(0, Qt.Checked)
+            items.append(newitem)
+
+        # Add the items in bulk, preserving their order
+        sorting = self.tree.isSortingEnabled()
+        self.tree.setSortingEnabled(False)
+        self.tree.clear()
+        self.tree.addTopLevelItems(items)
+        self.tree.header().setSortIndicator(-1, Qt.AscendingOrder)
+        self.tree.setSortingEnabled(sorting)
+        self.updateButtons()
+
+    def saveToLibrary(self):
+        """
+        Saves the songs found since the last call to the library.
+        """
+        if self.pending:
+            globalz.library.addSongs(self.pending)
+            self.pending = []
+
+    def loadNewSongs(self):
+        """
+        Loads the library songs that were never exported.
+        """
+        self.saveToLibrary()
+        self.loadEntries(globalz.library.getNewSongs())
+
+    def searchLibrary(self):
+        """
+        Loads the library songs matching the user's query.
+        """
+        query, ok = QtWidgets.QInputDialog.getText(self, 'Search Library', 'Find songs by name, artist, album or genre:')
+        if ok and query:
+            self.saveToLibrary()
+            self.loadEntries(globalz.library.search(query))
+
     def removeEntry(self):
         """
         Removes the checked entries from the playlist.
@@ -132,31 +252,185 @@ class Playlist(QtWidgets.QWidget):
 
     def exportEntry(self):
         """
-        Exports the playlist to a M3U file.
+        Exports the checked entries to a playlist file (on a separate thread).
         """
+        if self.isTaskRunning():
+            return
+
         file = QtWidgets.QFileDialog.getSaveFileName(self,
                                                 'Save Playlist',
                                                 'playlist.m3u',
-                                                'Playlists (*.m3u);;')[0]
+                                                getFileFilter())[0]
+        if not file:
+            return
+
+        # Take a snapshot of the checked items, so they can be edited during the export
+        # Point the songs to the cached audio files if enabled
+        entries = []
+        for i in range(self.tree.topLevelItemCount()):
+            item = self.tree.topLevelItem(i)
+            if item.checkState(0) == Qt.Checked:
+                song = copy.copy(item.data(0, Qt.UserRole))
+                if globalz.exportlocal:
+                    path = getCachedAudio(song.audiourl)
+                    if path:
+                        song.audiourl = QtCore.QUrl.fromLocalFile(path).toString()
+                entries.append((song, item.text(5)))
+
+        # Run the exporter, marking the songs as exported in the library when done
+        worker = PlaylistExporter(file, entries)
+        worker.exported.connect(self.markExported)
+        self.runTask(worker)
+
+    def markExported(self, songs: list):
+        """
+        Marks the exported songs in the library.
+        """
+        self.saveToLibrary()
+        globalz.library.markExported(songs)
+
+    def validateLinks(self):
+        """
+        Checks the audio links of the checked entries (on a separate thread).
+        """
+        if self.isTaskRunning():
+            return
+
+        # Get the sources whose links lead to web pages
+        pagesources = {plugin.name for plugin in getMainWindow(self).modulelist.values() if plugin.pagelinks}
+
+        # Map each link to its items
+        self.linkitems = {}
+        pageurls = set()
+        for i in range(self.tree.topLevelItemCount()):
+            item = self.tree.topLevelItem(i)
+            if item.checkState(0) == Qt.Checked:
+                url = item.data(0, Qt.UserRole).audiourl
+                self.linkitems.setdefault(url, []).append(item)
+                if item.text(5) in pagesources:
+                    pageurls.add(url)
+
+        # Run the validator
+        worker = LinkValidator(list(self.linkitems), pageurls)
+        worker.linkchecked.connect(self.markLink)
+        self.runTask(worker)
+
+    def markLink(self, url: str, ok: bool):
+        """
+        Flags the entries with a broken link and unchecks them, or clears the flag if the link works.
+        """
+        for item in self.linkitems.get(url, []):
+
+            # Skip items removed from the playlist in the meantime
+            try:
+                if item.treeWidget() is not self.tree:
+                    continue
+            except RuntimeError:
+                continue
+
+            for column in range(self.tree.columnCount()):
+                item.setForeground(column, QtGui.QBrush() if ok else QtGui.QBrush(Qt.red))
+            item.setToolTip(1, '' if ok else 'Broken link!')
+            if not ok:
+                item.setCheckState(0, Qt.Unchecked)
+
+        # Update buttons
+        self.updateButtons()
+
+    def prefetchAudio(self):
+        """
+        Downloads the audio of the checked entries (or the visible ones if none is checked) to the cache.
+        """
+        if self.isTaskRunning():
+            return
 
-        printline(self, 'Exporting playlist to', file + '...')
-        with open(file, 'w', encoding='utf-8', errors='replace') as f:
-            # Write header
-            f.write('#EXTM3U\n')
+        # Get the checked items
+        urls = []
+        for i in range(self.tree.topLevelItemCount()):
+            item = self.tree.topLevelItem(i)
+            if item.checkState(0) == Qt.Checked:
+                urls.append(item.data(0, Qt.UserRole).audiourl)
 
-            # Get all checked items
-            for i in range(self.tree.topLevelItemCount()):
-                item = self.tree.topLevelItem(i)
-                if item.checkState(0) == Qt.Checked:
-                    data = item.data(0, Qt.UserRole)
+        # Else get the visible ones
+        if not urls:
+            item = self.tree.itemAt(0, 0)
+            height = self.tree.viewport().height()
+            while item and self.tree.visualItemRect(item).top() < height:
+                urls.append(item.data(0, Qt.UserRole).audiourl)
+                item = self.tree.itemBelow(item)
 
-                    # Write the data
-                    f.write(f'#EXTINF:-1,{data.artist} - {data.name}')
-                    if data.album:
-                        f.write(f' ({data.album})')
-                    f.write(f'\n{data.audiourl}\n')
+        # Run the prefetcher
+        self.runTask(AudioPrefetcher(list(dict.fromkeys(urls))))
 
-        printline(self, 'Export complete!')
+    def startLiveExport(self, file: str):
+        """
+        Starts appending the songs added to the playlist to the given file.
+        """
+        self.stopLiveExport()
+        self.liveexporter = LiveExporter(file)
+        printline(self, 'Live exporting new songs to', file + '...')
+
+    def stopLiveExport(self):
+        """
+        Stops the live export.
+        """
+        if self.liveexporter:
+            self.liveexporter.close()
+            self.liveexporter = None
+            printline(self, 'Live export stopped!')
+
+    def isTaskRunning(self) -> bool:
+        """
+        Checks if a playlist task is running, warning the user if so.
+        """
+        if self.taskthread and self.taskthread.isRunning():
+            QtWidgets.QMessageBox.warning(self, 'Task Running!', 'Please stop the current playlist task or wait for it to finish first.')
+            return True
+        return False
+
+    def runTask(self, worker: QtCore.QObject):
+        """
+        Runs a playlist task (such as an export) on a separate thread.
+        """
+        self.taskthread = QtCore.QThread(self)
+        self.taskworker = worker
+        worker.moveToThread(self.taskthread)
+
+        # Run event
+        self.taskthread.started.connect(worker.run)
+
+        # End events
+        worker.finished.connect(self.taskthread.quit)
+        worker.finished.connect(worker.deleteLater)
+        self.taskthread.finished.connect(self.taskthread.deleteLater)
+        self.taskthread.finished.connect(self.endTask)
+
+        # Print to the console
+        worker.textappended.connect(getMainWindow(self).centralWidget().console.textinput.append)
+
+        # Start the thread!
+        self.taskthread.start()
+
+    def stopTask(self, wait: bool = False):
+        """
+        Stops the running playlist task, optionally waiting for it to end.
+        """
+        if not self.taskthread or not self.taskthread.isRunning():
+            return
+        printline(self, 'Stopping the playlist task...')
+        self.taskworker.terminate = True
+
+        # Keep processing events while waiting, as the thread is ended through them
+        while wait and self.taskthread:
+            self.taskthread.wait(int(globalz.pollinterval * 1000))
+            QtWidgets.QApplication.processEvents()
+
+    def endTask(self):
+        """
+        Unsets the task thread and worker.
+        """
+        self.taskthread = None
+        self.taskworker = None
 
     def clearPlaylist(self):
         """
@@ -183,9 +457,9 @@ class Playlist(QtWidgets.QWidget):
         """
         Updates/reverts song metadata changes.
         """
-        # Check if data exists
+        # Check if data exists and the column is editable (other columns change when checking or flagging items)
         data = item.data(0, Qt.UserRole)
-        if not data:
+        if not data or not 1 <= column <= 4:
             return
 
         # Get new and old text
@@ -219,7 +493,9 @@ class Playlist(QtWidgets.QWidget):
         Opens a song in the browser if double clicked.
         """
         if column != 0:
-            webbrowser.open(song.data(0, Qt.UserRole).audiourl)
+            audiourl = song.data(0, Qt.UserRole).audiourl
+            path = getCachedAudio(audiourl)
+            webbrowser.open(QtCore.QUrl.fromLocalFile(path).toString() if path else audiourl)
 
     def eventFilter(self, obj: QtCore.QObject, event: QtCore.QEvent) -> bool:
         """
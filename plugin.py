@@ -36,6 +36,71 @@ class Plugin:
         self.module = module
         self.modname = modname
         self.enabled = True
+        self.pagelinks = False
+
+    def load(self) -> object:
+        """
+        Gets the plugin's module, importing it if only its stored metadata was scanned.
+        """
+        if self.module is None:
+            self.module = sys.modules.get(self.modname) or importlib.import_module(self.modname)
+        return self.module
+
+
+def getFileStat(path: str) -> list:
+    """
+    Gets the modification time and size of a file, or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        return None
+
+
+def isManifestCurrent(manifest: dict, modname: str) -> bool:
+    """
+    Checks if the stored metadata of a plugin matches its file and data files.
+    """
+    if not manifest or manifest.get('stat') != getFileStat(os.path.join(globalz.modulefolder, f'{modname}.py')):
+        return False
+    return all(getFileStat(os.path.join(globalz.modulefolder, file)) == stat for file, stat in manifest.get('files', {}).items())
+
+
+def saveManifest(modname: str, data: dict, plugin: Plugin = None, success: bool = False) -> None:
+    """
+    Stores the metadata of a scanned plugin, along with the state of its file and data files.
+    """
+    files = data.get('files', [])
+    files = [str(file) for file in files] if type(files) == list else []
+    manifest = {'stat': getFileStat(os.path.join(globalz.modulefolder, f'{modname}.py')),
+                'files': {file: getFileStat(os.path.join(globalz.modulefolder, file)) for file in files},
+                'success': bool(success)}
+
+    if plugin:
+        manifest |= {'name': plugin.name, 'author': plugin.author, 'version': plugin.version,
+                     'description': plugin.description, 'genres': list(plugin.genres), 'pagelinks': plugin.pagelinks}
+    globalz.storage.setValue('plugins', modname, manifest)
+
+
+def createPlugin(data: dict, module: object, modname: str) -> Plugin:
+    """
+    Creates a plugin from its metadata.
+    """
+    plugin = Plugin(data['name'], module, modname)
+
+    # Fill in the rest of the metadata (assuming conversions to string won't fail)
+    plugin.author = str(data.get('author', ''))
+    plugin.version = str(data.get('version', ''))
+    plugin.description = str(data.get('description', ''))
+    plugin.pagelinks = bool(data.get('pagelinks', False))
+
+    # Genres with string failsafe
+    genres = data.get('genres', [])
+    if type(genres) == list:
+        for genre in genres:
+            plugin.genres[str(genre)] = True
+    return plugin
 
 
 class PluginScanner(QtCore.QObject):
@@ -62,10 +127,21 @@ class PluginScanner(QtCore.QObject):
             if file[1] != '.py':
                 continue
 
+            # If the file and its data files didn't change since the last scan, use the stored metadata without importing it
+            manifest = globalz.storage.getValue('plugins', file[0])
+            if isManifestCurrent(manifest, file[0]):
+                if manifest['success']:
+                    self.pluginfound.emit(createPlugin(manifest, None, file[0]))
+                continue
+
             # Try importing the file, skip if it fails
-            # Don't reimport the module if it's already imported
+            # Don't reimport the module if it's already imported, unless it changed since the last scan
             try:
-                module = sys.modules.get(file[0], importlib.import_module(file[0]))
+                module = sys.modules.get(file[0])
+                if module is None:
+                    module = importlib.import_module(file[0])
+                elif manifest:
+                    module = importlib.reload(module)
             except Exception as e:
                 printline(self, 'Failed to import module', file[0] + ':', e)
                 continue
@@ -74,6 +150,7 @@ class PluginScanner(QtCore.QObject):
             data = getattr(module, globalz.pluginmeta, None)
             if not isinstance(data, dict) or 'name' not in data:
                 printline(self, 'Module', file[0], 'is missing the required metadata!')
+                saveManifest(file[0], {})
                 module = deleteModule(module, file[0])
                 continue
 
@@ -81,31 +158,25 @@ class PluginScanner(QtCore.QObject):
             func = getattr(module, globalz.mainfunc, None)
             if not callable(func):
                 printline(self, 'Module', file[0], 'is missing the main function!')
+                saveManifest(file[0], data)
                 module = deleteModule(module, file[0])
                 continue
 
             # Create the plugin class
-            plugin = Plugin(data['name'], module, file[0])
-
-            # Fill in the rest of the metadata (assuming conversions to string won't fail)
-            plugin.author = str(data.get('author', ''))
-            plugin.version = str(data.get('version', ''))
-            plugin.description = str(data.get('description', ''))
-
-            # Genres with string failsafe
-            genres = data.get('genres', [])
-            if type(genres) == list:
-                for genre in genres:
-                    plugin.genres[str(genre)] = True
+            plugin = createPlugin(data, module, file[0])
 
             # Assume the plugin will be added
             success = True
 
-            # Check if the scan function exists and run it if so
+            # Check if the scan function exists and run it if so (the plugin data can be used from it)
             func = getattr(module, globalz.scanfunc, None)
             if callable(func):
+                self.current = plugin
                 success = func(self, plugin)
 
+            # Store the resulting metadata for the next scans
+            saveManifest(file[0], data, plugin, success)
+
             # Emit event to save plugin on success
             if success:
                 self.pluginfound.emit(plugin)
@@ -3,13 +3,14 @@
 # scraping.py
 # This file defines GimmeMusic's scraping functionality.
 
-import requests
+import math
+import threading
+import time
+
 from qtpy import QtCore
-from cachecontrol import CacheControl
-from cachecontrol.caches.file_cache import FileCache
 
 import globalz
-from common import printline
+from common import CancelToken, printline
 
 
 class Song:
@@ -23,6 +24,91 @@ class Song:
         self.genre = genre
         self.audiourl = audiourl
 
+
+class ScrapeCheckpoint:
+    """
+    Persists the progress of a scrape and the songs added to the playlist so far, so that interrupted scrapes can be resumed.
+    The songs are saved along with the progress.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {'modules': [], 'genres': {}}
+        self.songcount = 0
+        self.songs = []
+
+    @staticmethod
+    def exists() -> bool:
+        """
+        Checks if an interrupted scrape was saved.
+        """
+        return globalz.storage.getValue('checkpoint', 'state') is not None
+
+    def load(self) -> list:
+        """
+        Loads the saved progress and returns the (song, source) tuples found so far.
+        """
+        self.state = globalz.storage.getValue('checkpoint', 'state', self.state)
+        songs = globalz.storage.getValues('checkpointsongs')
+        self.songcount = len(songs)
+        return [(Song(*song[:5]), song[5]) for song in songs]
+
+    def save(self) -> None:
+        """
+        Saves the progress and the songs added since the last save.
+        """
+        with self.lock:
+            globalz.storage.setValues([('checkpoint', 'state', self.state)] + self.songs)
+            self.songs = []
+
+    def clear(self) -> None:
+        """
+        Deletes the saved progress.
+        """
+        with self.lock:
+            self.songs = []
+        globalz.storage.removeValue('checkpoint', 'state')
+        globalz.storage.removeValues('checkpointsongs')
+
+    def isModuleDone(self, modname: str) -> bool:
+        """
+        Checks if the module was completed before the interruption.
+        """
+        return modname in self.state['modules']
+
+    def setModuleDone(self, modname: str) -> None:
+        """
+        Marks the module as completed, discarding its genre progress.
+        """
+        with self.lock:
+            self.state['modules'].append(modname)
+            self.state['genres'].pop(modname, None)
+        self.save()
+
+    def getGenre(self, modname: str, key: str) -> dict:
+        """
+        Gets the progress of a module's genre.
+        """
+        with self.lock:
+            return self.state['genres'].get(modname, {}).get(key, {})
+
+    def setGenre(self, modname: str, key: str, state: dict, save: bool = False) -> None:
+        """
+        Updates the progress of a module's genre, optionally saving it immediately.
+        """
+        with self.lock:
+            self.state['genres'].setdefault(modname, {})[key] = state
+        if save:
+            self.save()
+
+    def addSong(self, song: Song, source: str) -> None:
+        """
+        Records a song added to the playlist, to be saved with the progress.
+        """
+        with self.lock:
+            self.songcount += 1
+            self.songs.append(('checkpointsongs', str(self.songcount), [song.name, song.artist, song.album, song.genre, song.audiourl, source]))
+
+
 class SongScraper(QtCore.QObject):
     """
     Plugin runner (this runs on a separate thread from the GUI).
@@ -30,41 +116,112 @@ class SongScraper(QtCore.QObject):
     finished = QtCore.Signal()
     textappended = QtCore.Signal(str)
     songfound = QtCore.Signal(Song, str)
+    songsrestored = QtCore.Signal(list)
 
-    def __init__(self, parent):
+    def __init__(self, parent, resume: bool = False):
         """
         Modified init function so we have access to the modulelist without accessing the rest of the program
         """
         super().__init__()
         self.modulelist = parent.modulelist
-        self.terminate = False
-        parent.stopscrape.connect(lambda: setattr(self, 'terminate', True))
+        self.current = None
+        self.token = CancelToken()
+        self.deadline = math.inf
+        parent.stopscrape.connect(self.token.cancel)
+
+        # The playlist records the songs it accepts to the checkpoint
+        self.resume = resume
+        self.checkpoint = ScrapeCheckpoint()
+
+    @property
+    def terminate(self) -> bool:
+        """
+        Checks if termination was invoked or the running module's time budget ran out (cheap enough to be called from plugin loops).
+        """
+        return self.token.cancelled or time.monotonic() >= self.deadline
 
     def run(self):
         printline(self, 'Initiating song scrape...')
 
-        # Create the requests session
-        self.session = CacheControl(requests.Session(), cache=FileCache(globalz.cachedir))
+        # Create the requests session (the scraping stack is only imported here, to keep the startup fast)
+        import requests
+        from cachecontrol import CacheControl
+        from webcache import CompressedFileCache
+        self.session = CacheControl(requests.Session(), cache=CompressedFileCache(globalz.cachedir))
+
+        # Restore the interrupted scrape's songs, or discard it
+        # They are added to the playlist directly, as they already passed its checks and may be in the library already
+        if self.resume:
+            songs = self.checkpoint.load()
+            printline(self, 'Resuming interrupted scrape,', len(songs), 'songs restored...')
+            self.songsrestored.emit(songs)
+        else:
+            self.checkpoint.clear()
+
+        # Get the time budget of the whole run (0 means unlimited)
+        rundeadline = time.monotonic() + globalz.runtimeout * 60 if globalz.runtimeout else math.inf
 
         # Run each module
+        failed = False
+        overrun = False
         for modname, module in self.modulelist.items():
 
             # If the thread was terminated, quit the loop immediately
             if self.terminate:
                 break
 
+            # If the run is out of time, skip the remaining modules
+            if time.monotonic() >= rundeadline:
+                printline(self, 'Run time budget exceeded! Skipping the remaining modules...')
+                overrun = True
+                break
+
             # Run module only if enabled
             if module.enabled:
+
+                # Skip modules completed before the interruption
+                if self.checkpoint.isModuleDone(modname):
+                    printline(self, 'Module', modname, 'was already completed. Skipping...')
+                    continue
+
                 printline(self, 'Running module', modname + '...')
+                self.current = module
+
+                # Set the module's deadline, which cancels it when reached
+                moduledeadline = time.monotonic() + globalz.plugintimeout * 60 if globalz.plugintimeout else math.inf
+                self.deadline = min(moduledeadline, rundeadline)
 
                 # Run the module's main function and process the output
                 try:
-                    func = getattr(module.module, globalz.mainfunc, None)
+                    func = getattr(module.load(), globalz.mainfunc, None)
                     func(self, module)
                 except Exception as e:
                     printline(self, 'Failed to execute module', modname + ':', e)
+                    failed = True
+                    continue
+                finally:
+                    timedout = time.monotonic() >= self.deadline
+                    self.deadline = math.inf
+
+                # Report the overrun, keeping the songs found so far
+                if timedout and not self.terminate:
+                    printline(self, 'Module', modname, 'exceeded its time budget! Keeping the partial results...')
+                    overrun = True
+                    continue
+
+                # Mark the module as completed
+                if not self.terminate:
+                    self.checkpoint.setModuleDone(modname)
+
+        # Keep the progress if the scrape was not completed, else discard it
+        if self.terminate or failed or overrun:
+            self.checkpoint.save()
+            printline(self, 'Progress saved, the scrape can be resumed by pressing START again.')
+        else:
+            self.checkpoint.clear()
 
-        # Emit event when loop ends
+        # Close the session and emit event when loop ends
+        self.session.close()
         self.finished.emit()
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# session.py
+# This file defines GimmeMusic's playlist session format.
+#
+# Sessions are stored in a compact columnar format (all values little-endian):
+# - Header: magic, version, string count, row count
+# - String table: each unique string (UTF-8), prefixed by its length as u32
+# - Check column: one byte per row
+# - One u32 column per song field (name, artist, album, genre, audiourl, source), containing string table indices
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from scraping import Song
+
+headerfmt = '<4sHII'
+magic = b'GMPS'
+version = 1
+fieldcount = 6
+
+
+def writeSession(path: str, rows: list) -> None:
+    """
+    Saves a list of (song, source, checked) tuples to the given file.
+    The file is written to a temporary one first and then replaces the old one, so a failed write doesn't corrupt it.
+    """
+    strings = {}
+    checks = bytearray()
+    columns = [array('I') for _ in range(fieldcount)]
+
+    # Intern all strings and fill the columns
+    for song, source, checked in rows:
+        checks.append(checked)
+        values = [song.name, song.artist, song.album, song.genre, song.audiourl, source]
+        for column, value in zip(columns, values):
+            column.append(strings.setdefault(value, len(strings)))
+
+    # Convert the columns to little endian if needed
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+
+    # Build the string table
+    table = bytearray()
+    for string in strings:
+        data = string.encode('utf-8', errors='replace')
+        table += struct.pack('<I', len(data))
+        table += data
+
+    # Write everything, removing the temporary file on failure
+    temppath = path + '.tmp'
+    try:
+        with open(temppath, 'wb') as f:
+            f.write(struct.pack(headerfmt, magic, version, len(strings), len(rows)))
+            f.write(table)
+            f.write(checks)
+            for column in columns:
+                f.write(column.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temppath, path)
+    except Exception:
+        try:
+            os.remove(temppath)
+        except OSError:
+            pass
+        raise
+
+
+def readSession(path: str) -> list:
+    """
+    Loads a list of (song, source, checked) tuples from the given file.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+
+        # Check the header
+        filemagic, fileversion, stringcount, rowcount = struct.unpack_from(headerfmt, m)
+        if filemagic != magic or fileversion != version:
+            raise Exception('Invalid session file!')
+
+        # Read the string table
+        offset = struct.calcsize(headerfmt)
+        strings = []
+        for _ in range(stringcount):
+            length, = struct.unpack_from('<I', m, offset)
+            offset += 4
+            strings.append(m[offset:offset + length].decode('utf-8', errors='replace'))
+            offset += length
+
+        # Read the check column
+        checks = m[offset:offset + rowcount]
+        offset += rowcount
+
+        # Read the field columns, resolving the strings directly
+        columns = []
+        for _ in range(fieldcount):
+            column = array('I', m[offset:offset + rowcount * 4])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append([strings[i] for i in column])
+            offset += rowcount * 4
+
+    # Build the rows
+    return [(Song(*values[:5]), values[5], bool(checked)) for checked, *values in zip(checks, *columns)]
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
@@ -12,6 +12,7 @@ from qtpy.QtCore import Qt
 
 import globalz
 from common import getMainWindow, printline, fakeUAHeader
+from plugin import Plugin
 
 
 class Settings(QtWidgets.QDialog):
@@ -48,6 +49,27 @@ class Settings(QtWidgets.QDialog):
             i = self.tabs.widget(0).maxdays.value()
             globalz.lastuse = QtCore.QDate.currentDate().addDays(-i + 1)
 
+            # Save backfill options
+            globalz.backfill = self.tabs.widget(0).backfilldate.date() if self.tabs.widget(0).backfill.isChecked() else None
+            globalz.backfillend = self.tabs.widget(0).backfillend.date() if self.tabs.widget(0).backfill.isChecked() else None
+            globalz.backfilldays = self.tabs.widget(0).backfilldays.value()
+
+            # Save incremental scraping option
+            globalz.incremental = self.tabs.widget(0).incremental.isChecked()
+
+            # Save known songs option
+            globalz.skipknown = self.tabs.widget(0).skipknown.isChecked()
+
+            # Save audio cache options
+            globalz.audiocachesize = self.tabs.widget(0).audiocachesize.value()
+            globalz.exportlocal = self.tabs.widget(0).exportlocal.isChecked()
+
+            # Save time limits
+            globalz.connecttimeout = self.tabs.widget(0).connecttimeout.value()
+            globalz.readtimeout = self.tabs.widget(0).readtimeout.value()
+            globalz.plugintimeout = self.tabs.widget(0).plugintimeout.value()
+            globalz.runtimeout = self.tabs.widget(0).runtimeout.value()
+
             # Save user agent, if the string isn't empty
             newua = self.tabs.widget(0).fakeUA.text()
             if newua:
@@ -55,7 +77,8 @@ class Settings(QtWidgets.QDialog):
 
             # Save artist blacklist
             tree = self.tabs.widget(0).tree
-            mw.config.setValue('Blacklist/blacklist', ','.join([tree.item(i).text() for i in range(tree.count())]))
+            globalz.blacklist = [tree.item(i).text() for i in range(tree.count())]
+            mw.config.setValue('Blacklist/blacklist', ','.join(globalz.blacklist))
 
             # Save plugins - use the modulelist this time
             modulelist = mw.modulelist
@@ -99,12 +122,92 @@ class GeneralSettings(QtWidgets.QWidget):
         olddate = globalz.lastuse
         self.maxdays.setValue(olddate.daysTo(currdate) + 1)
 
+        ####################
+        # Backfill Options #
+        ####################
+        self.backfill = QtWidgets.QCheckBox(self)
+        self.backfill.setChecked(bool(globalz.backfill))
+        self.backfill.setToolTip('Get all the releases between the given dates (only for this session).')
+
+        self.backfilldate = QtWidgets.QDateEdit(globalz.backfill or currdate.addDays(-30), self)
+        self.backfilldate.setCalendarPopup(True)
+        self.backfilldate.setMaximumDate(currdate)
+        self.backfilldate.setEnabled(self.backfill.isChecked())
+        self.backfill.toggled.connect(self.backfilldate.setEnabled)
+
+        # Keep the end date after the start date
+        self.backfillend = QtWidgets.QDateEdit(globalz.backfillend or currdate, self)
+        self.backfillend.setCalendarPopup(True)
+        self.backfillend.setDateRange(self.backfilldate.date(), currdate)
+        self.backfillend.setEnabled(self.backfill.isChecked())
+        self.backfill.toggled.connect(self.backfillend.setEnabled)
+        self.backfilldate.dateChanged.connect(self.backfillend.setMinimumDate)
+
+        self.backfilldays = QtWidgets.QSpinBox(self)
+        self.backfilldays.setSuffix(' days')
+        self.backfilldays.setRange(1, 365)
+        self.backfilldays.setValue(globalz.backfilldays)
+        self.backfilldays.setToolTip('Backfills are split into date ranges of this size, which are scraped in parallel.')
+
+        ###############################
+        # Incremental Scraping Option #
+        ###############################
+        self.incremental = QtWidgets.QCheckBox(self)
+        self.incremental.setChecked(globalz.incremental)
+        self.incremental.setToolTip('Stop scraping each genre when reaching releases found in previous runs.')
+
+        ######################
+        # Known Songs Option #
+        ######################
+        self.skipknown = QtWidgets.QCheckBox(self)
+        self.skipknown.setChecked(globalz.skipknown)
+        self.skipknown.setToolTip('Do not add songs stored in the library to the playlist.')
+
         ##########################
         # Fake User Agent Option #
         ##########################
         self.fakeUA = QtWidgets.QLineEdit(fakeUAHeader['user-agent'], self)
         self.fakeUA.setPlaceholderText('Insert a User-Agent here...')
 
+        #######################
+        # Audio Cache Options #
+        #######################
+        self.audiocachesize = QtWidgets.QSpinBox(self)
+        self.audiocachesize.setSuffix(' MB')
+        self.audiocachesize.setRange(0, 1048576)
+        self.audiocachesize.setValue(globalz.audiocachesize)
+
+        self.exportlocal = QtWidgets.QCheckBox(self)
+        self.exportlocal.setChecked(globalz.exportlocal)
+        self.exportlocal.setToolTip('Export prefetched songs as local files instead of links.')
+
+        ######################
+        # Time Limit Options #
+        ######################
+        self.connecttimeout = QtWidgets.QSpinBox(self)
+        self.connecttimeout.setSuffix(' s')
+        self.connecttimeout.setRange(1, 300)
+        self.connecttimeout.setValue(globalz.connecttimeout)
+
+        self.readtimeout = QtWidgets.QSpinBox(self)
+        self.readtimeout.setSuffix(' s')
+        self.readtimeout.setRange(1, 300)
+        self.readtimeout.setValue(globalz.readtimeout)
+
+        self.plugintimeout = QtWidgets.QSpinBox(self)
+        self.plugintimeout.setSuffix(' min')
+        self.plugintimeout.setSpecialValueText('Unlimited')
+        self.plugintimeout.setRange(0, 1440)
+        self.plugintimeout.setValue(globalz.plugintimeout)
+        self.plugintimeout.setToolTip('Stop each plugin after this time, keeping the songs found so far.')
+
+        self.runtimeout = QtWidgets.QSpinBox(self)
+        self.runtimeout.setSuffix(' min')
+        self.runtimeout.setSpecialValueText('Unlimited')
+        self.runtimeout.setRange(0, 1440)
+        self.runtimeout.setValue(globalz.runtimeout)
+        self.runtimeout.setToolTip('Stop the scrape after this time, keeping the songs found so far.')
+
         ######################
         # Clear Cache Option #
         ######################
@@ -120,12 +223,8 @@ class GeneralSettings(QtWidgets.QWidget):
         # Allow editing list items by selecting and clicking
         self.tree.setEditTriggers(QtWidgets.QAbstractItemView.SelectedClicked)
 
-        # Get the artist list, discarding whitespace and removing duplicates
-        blacklist = getMainWindow(self).config.value('Blacklist/blacklist', '')
-        blacklist = blacklist.split(',') if blacklist else []
-
-        # Fill the tree
-        for artist in blacklist:
+        # Fill the tree with the artist list
+        for artist in globalz.blacklist:
             newitem = QtWidgets.QListWidgetItem(artist, self.tree)
             newitem.setFlags(newitem.flags() | Qt.ItemIsEditable)
 
@@ -165,8 +264,23 @@ class GeneralSettings(QtWidgets.QWidget):
         # Add the lastuse setting to a form layout
         form = QtWidgets.QFormLayout(frame)
         form.addRow('Get releases from the last:', self.maxdays)
+        backfillrow = QtWidgets.QHBoxLayout()
+        backfillrow.addWidget(self.backfill)
+        backfillrow.addWidget(self.backfilldate, 1)
+        backfillrow.addWidget(QtWidgets.QLabel('to', self))
+        backfillrow.addWidget(self.backfillend, 1)
+        form.addRow('Backfill releases from:', backfillrow)
+        form.addRow('Backfill partition size:', self.backfilldays)
+        form.addRow('Only get new releases:', self.incremental)
+        form.addRow('Skip songs found in previous runs:', self.skipknown)
         form.addRow('Scraper User-Agent:', self.fakeUA)
+        form.addRow('Connection timeout:', self.connecttimeout)
+        form.addRow('Read timeout:', self.readtimeout)
+        form.addRow('Plugin time budget:', self.plugintimeout)
+        form.addRow('Scrape time budget:', self.runtimeout)
         form.addRow('Web Cache:', self.clearCacheBtn)
+        form.addRow('Audio Cache Size:', self.audiocachesize)
+        form.addRow('Export cached audio files:', self.exportlocal)
 
         # Add the frame to the grid layout
         L.addWidget(frame, 1, 0, 1, 2)
@@ -357,6 +471,53 @@ def readconfig(config: QtCore.QSettings):
     # Initialize the fake UA
     fakeUAHeader['user-agent'] = config.value('General/fakeUA', globalz.defaultUA)
 
+    # Initialize backfill partition size (backfilling itself is not saved)
+    globalz.backfilldays = int(config.value('General/backfilldays', globalz.backfilldays))
+
+    # Initialize artist blacklist
+    blacklist = config.value('Blacklist/blacklist', '')
+    globalz.blacklist = blacklist.split(',') if blacklist else []
+
+    # Initialize incremental scraping
+    globalz.incremental = config.value('General/incremental', 'false') == 'true'
+
+    # Initialize known songs option
+    globalz.skipknown = config.value('General/skipknown', 'false') == 'true'
+
+    # Initialize time limits
+    globalz.connecttimeout = int(config.value('General/connecttimeout', globalz.connecttimeout))
+    globalz.readtimeout = int(config.value('General/readtimeout', globalz.readtimeout))
+    globalz.plugintimeout = int(config.value('General/plugintimeout', globalz.plugintimeout))
+    globalz.runtimeout = int(config.value('General/runtimeout', globalz.runtimeout))
+
+    # Initialize audio cache options
+    globalz.audiocachesize = int(config.value('General/audiocachesize', globalz.audiocachesize))
+    globalz.exportlocal = config.value('General/exportlocal', 'false') == 'true'
+
+
+def readpluginconfig(config: QtCore.QSettings, plugin: Plugin):
+    """
+    Initializes a plugin's status and enabled genres.
+    """
+    plugin.enabled = config.value(f'Plugins/{plugin.modname}', 'false') == 'true'
+    if not plugin.genres:
+        return
+
+    # The enabled genres are stored as a single list
+    genrekey = f'Plugins/{plugin.modname}_genres'
+    if config.contains(genrekey):
+        enabled = config.value(genrekey) or []
+        enabled = {enabled} if isinstance(enabled, str) else set(enabled)
+        for genre in plugin.genres:
+            plugin.genres[genre] = genre in enabled
+
+    # Otherwise migrate the old layout (one key per genre), removing its keys
+    else:
+        for genre in plugin.genres:
+            confkey = f'Plugins/{plugin.modname}_{genre}'
+            plugin.genres[genre] = config.value(confkey, 'false') == 'true'
+            config.remove(confkey)
+
 
 def writeconfig(config: QtCore.QSettings, modulelist: dict, mwgeometry: QtCore.QByteArray, mwstate: QtCore.QByteArray, splitterstate: QtCore.QByteArray):
     """
@@ -368,6 +529,25 @@ def writeconfig(config: QtCore.QSettings, modulelist: dict, mwgeometry: QtCore.Q
     # Set user agent
     config.setValue('General/fakeUA', fakeUAHeader['user-agent'])
 
+    # Set backfill partition size
+    config.setValue('General/backfilldays', globalz.backfilldays)
+
+    # Set incremental scraping
+    config.setValue('General/incremental', globalz.incremental)
+
+    # Set known songs option
+    config.setValue('General/skipknown', globalz.skipknown)
+
+    # Set time limits
+    config.setValue('General/connecttimeout', globalz.connecttimeout)
+    config.setValue('General/readtimeout', globalz.readtimeout)
+    config.setValue('General/plugintimeout', globalz.plugintimeout)
+    config.setValue('General/runtimeout', globalz.runtimeout)
+
+    # Set audio cache options
+    config.setValue('General/audiocachesize', globalz.audiocachesize)
+    config.setValue('General/exportlocal', globalz.exportlocal)
+
     # Remove blacklist section if empty
     if not config.value('Blacklist/blacklist', []):
         config.remove('Blacklist')
@@ -376,8 +556,8 @@ def writeconfig(config: QtCore.QSettings, modulelist: dict, mwgeometry: QtCore.Q
     if modulelist:
         for module, moduledata in modulelist.items():
             config.setValue(f'Plugins/{module}', moduledata.enabled)
-            for genre, genrestatus in moduledata.genres.items():
-                config.setValue(f'Plugins/{module}_{genre}', genrestatus)
+            if moduledata.genres:
+                config.setValue(f'Plugins/{module}_genres', [genre for genre, genrestatus in moduledata.genres.items() if genrestatus])
     else:
         config.remove('Plugins')
 
@@ -386,10 +566,12 @@ def writeconfig(config: QtCore.QSettings, modulelist: dict, mwgeometry: QtCore.Q
     config.setValue('WindowSettings/mwstate', mwstate)
     config.setValue('WindowSettings/splitterstate', splitterstate)
 
-    # Remove any other unknown section
-    for section in config.allKeys():
-        if not section.startswith(('General', 'Plugins', 'Blacklist', 'WindowSettings')):
+    # Remove any other unknown section (only the top level is listed, instead of every key)
+    for section in config.childGroups():
+        if section not in ('General', 'Plugins', 'Blacklist', 'WindowSettings'):
             config.remove(section)
+    for key in config.childKeys():
+        config.remove(key)
 
     # Write to file
     config.sync()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# storage.py
+# This file defines GimmeMusic's persistent storage.
+
+import json
+import sqlite3
+import threading
+
+
+class Storage:
+    """
+    Thread-safe wrapper around the program's SQLite database.
+    Values are stored as JSON, grouped by namespace.
+    """
+    def __init__(self, path: str):
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS keyvalue (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (namespace, key))')
+        self.db.commit()
+
+    def getValue(self, namespace: str, key: str, default: object = None) -> object:
+        """
+        Gets a value from the given namespace, returning the default if not found.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT value FROM keyvalue WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def setValue(self, namespace: str, key: str, value: object) -> None:
+        """
+        Stores a value in the given namespace.
+        """
+        with self.lock, self.db:
+            self.db.execute('REPLACE INTO keyvalue VALUES (?, ?, ?)', (namespace, key, json.dumps(value)))
+
+    def setValues(self, entries: list) -> None:
+        """
+        Stores a list of (namespace, key, value) tuples in a single transaction.
+        """
+        with self.lock, self.db:
+            self.db.executemany('REPLACE INTO keyvalue VALUES (?, ?, ?)', [(namespace, key, json.dumps(value)) for namespace, key, value in entries])
+
+    def getValues(self, namespace: str) -> list:
+        """
+        Gets all the values in the given namespace, in insertion order.
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT value FROM keyvalue WHERE namespace = ? ORDER BY rowid', (namespace,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def removeValue(self, namespace: str, key: str) -> None:
+        """
+        Removes a value from the given namespace.
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM keyvalue WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def removeValues(self, namespace: str) -> None:
+        """
+        Removes all the values in the given namespace.
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM keyvalue WHERE namespace = ?', (namespace,))
+
+    def removeExpired(self, namespace: str, cutoff: float) -> None:
+        """
+        Removes the values in the given namespace whose time field is older than the cutoff.
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM keyvalue WHERE namespace = ? AND json_extract(value, '$.time') < ?", (namespace, cutoff))
+
+    def close(self) -> None:
+        """
+        Closes the database.
+        """
+        with self.lock:
+            self.db.close()
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
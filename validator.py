@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# validator.py
+# This file defines GimmeMusic's audio link validator.
+
+import time
+
+from qtpy import QtCore
+
+import globalz
+from audiocache import audiotypes
+from common import createSession, fakeUAHeader, getHostLimit, parallelMap, printline
+
+
+class LinkValidator(QtCore.QObject):
+    """
+    Checks that audio URLs are still reachable (this runs on a separate thread from the GUI).
+    Links in pageurls lead to web pages, so they are only checked for errors instead of for audio.
+    Results are cached in the storage for a limited time.
+    """
+    finished = QtCore.Signal()
+    textappended = QtCore.Signal(str)
+    linkchecked = QtCore.Signal(str, bool)
+
+    def __init__(self, urls: list, pageurls: set):
+        super().__init__()
+        self.urls = urls
+        self.pageurls = pageurls
+        self.terminate = False
+
+    def checkURL(self, url: str) -> bool:
+        """
+        Checks a single URL with a HEAD request, falling back to a ranged GET if HEAD isn't supported.
+        Audio links which don't end up on an audio file (such as redirects to a web page) are considered broken.
+        """
+        if self.terminate:
+            return None
+
+        try:
+            with getHostLimit(url):
+                timeout = (globalz.connecttimeout, globalz.readtimeout)
+                r = self.session.head(url, headers=fakeUAHeader, timeout=timeout, allow_redirects=True)
+                if r.status_code in (403, 405, 501):
+                    headers = fakeUAHeader | {'range': 'bytes=0-0'}
+                    with self.session.get(url, headers=headers, timeout=timeout, stream=True) as r:
+                        pass
+            return r.ok and (url in self.pageurls or r.headers.get('content-type', '').startswith(audiotypes))
+        except OSError:  # requests' exceptions derive from it
+            return False
+
+    def run(self):
+        printline(self, 'Validating', len(self.urls), 'links...')
+
+        # Remove the expired results, then use the cached ones if they were checked the same way
+        now = time.time()
+        globalz.storage.removeExpired('linkcheck', now - globalz.linkcheckttl)
+        unchecked = []
+        broken = 0
+        for url in self.urls:
+            result = globalz.storage.getValue('linkcheck', url)
+            if result and result.get('page', False) == (url in self.pageurls):
+                self.linkchecked.emit(url, result['ok'])
+                broken += not result['ok']
+            else:
+                unchecked.append(url)
+
+        # Check the remaining ones concurrently
+        self.session = createSession()
+
+        for url, ok in zip(unchecked, parallelMap(self, self.checkURL, unchecked)):
+            if ok is None:
+                continue
+            globalz.storage.setValue('linkcheck', url, {'ok': ok, 'time': now, 'page': url in self.pageurls})
+            self.linkchecked.emit(url, ok)
+            broken += not ok
+
+        self.session.close()
+        if self.terminate:
+            printline(self, 'Validation interrupted,', broken, 'broken links found!')
+        else:
+            printline(self, 'Validation complete,', broken, 'broken links found!')
+
+        # Emit event when done
+        self.finished.emit()
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")
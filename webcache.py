@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# webcache.py
+# This file defines GimmeMusic's compressed web cache.
+
+import os
+import threading
+import zlib
+
+from cachecontrol.caches.file_cache import FileCache
+
+# Attempt to import zstandard, falling back to zlib if missing
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression settings
+zlibLevel = 6
+zstdLevel = 9
+zstdMagic = b'\x28\xb5\x2f\xfd'
+zlibMagic = b'\x78'
+
+# Dictionary settings
+dictName = 'zstd.dict'
+dictSize = 112640
+dictSamples = 64
+
+
+class CompressedFileCache(FileCache):
+    """
+    FileCache variant which transparently compresses the cached entries.
+    Uses zstd (with a dictionary trained on the first cached pages) if available, else zlib.
+    Uncompressed entries written by previous versions are still read correctly.
+    The zstd (de)compressors aren't thread-safe, so each thread using the cache gets its own.
+    """
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(directory, **kwargs)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.samples = []
+        self.zdict = None
+
+        # Load the zstd dictionary if it was trained already
+        if zstandard:
+            try:
+                with open(os.path.join(directory, dictName), 'rb') as f:
+                    self.zdict = zstandard.ZstdCompressionDict(f.read())
+            except Exception:
+                pass
+
+    def getCodecs(self) -> threading.local:
+        """
+        Gets the calling thread's zstd (de)compressors, setting up the dictionary ones once the dictionary is available.
+        """
+        codecs = self.local
+        if not hasattr(codecs, 'compressor'):
+            codecs.compressor = zstandard.ZstdCompressor(level=zstdLevel)
+            codecs.decompressor = zstandard.ZstdDecompressor()
+            codecs.zdict = None
+            codecs.dictcompressor = None
+            codecs.dictdecompressor = None
+
+        # The dictionary is shared, so only set up its (de)compressors under the lock
+        if codecs.zdict is not self.zdict:
+            with self.lock:
+                codecs.zdict = self.zdict
+                codecs.dictcompressor = zstandard.ZstdCompressor(level=zstdLevel, dict_data=codecs.zdict)
+                codecs.dictdecompressor = zstandard.ZstdDecompressor(dict_data=codecs.zdict)
+        return codecs
+
+    def trainDictionary(self, value: bytes) -> None:
+        """
+        Collects cached entries and trains the zstd dictionary once enough samples are available.
+        Only one dictionary is trained, as the entries compressed with another one couldn't be read back.
+        """
+        with self.lock:
+            if self.zdict or self.samples is None:
+                return
+            self.samples.append(value)
+            if len(self.samples) < dictSamples:
+                return
+            samples = self.samples
+            self.samples = None
+
+        # Train the dictionary and save it, ignoring failures (not enough data, read-only disk...)
+        try:
+            zdict = zstandard.train_dictionary(dictSize, samples)
+            os.makedirs(self.directory, self.dirmode, exist_ok=True)
+            self._write(os.path.join(self.directory, dictName), zdict.as_bytes())
+            self.zdict = zdict
+        except Exception:
+            with self.lock:
+                self.samples = []
+
+    def compress(self, value: bytes) -> bytes:
+        """
+        Compresses a cache entry.
+        """
+        if not zstandard:
+            return zlib.compress(value, zlibLevel)
+
+        # Use the dictionary if available, else feed the entry to the trainer
+        codecs = self.getCodecs()
+        if codecs.dictcompressor:
+            return codecs.dictcompressor.compress(value)
+        self.trainDictionary(value)
+        return codecs.compressor.compress(value)
+
+    def decompress(self, value: bytes) -> bytes:
+        """
+        Decompresses a cache entry, detecting the format from its header.
+        """
+        if value.startswith(zstdMagic):
+            if not zstandard:
+                return None
+            codecs = self.getCodecs()
+            if zstandard.get_frame_parameters(value).dict_id:
+                if not codecs.dictdecompressor:
+                    return None
+                return codecs.dictdecompressor.decompress(value)
+            return codecs.decompressor.decompress(value)
+
+        if value.startswith(zlibMagic):
+            return zlib.decompress(value)
+
+        # Uncompressed entry
+        return value
+
+    def get(self, key: str) -> bytes:
+        value = super().get(key)
+        if not value:
+            return value
+
+        # Treat corrupted or unreadable entries as cache misses
+        try:
+            return self.decompress(value)
+        except Exception:
+            return None
+
+    def set(self, key: str, value: bytes, expires: object = None) -> None:
+        super().set(key, self.compress(value), expires)
+
+
+if __name__ == '__main__':
+    print("Run main.py to access the program!")